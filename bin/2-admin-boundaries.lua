@@ -9,6 +9,15 @@ tables.boundaries = osm2pgsql.define_area_table('boundaries', {
     { column = 'name', type = 'text' },
     { column = 'tags', type = 'jsonb' },
     { column = 'geom', type = 'multipolygon', projection = 4326 },
+}, {
+    -- Write the table sorted by geometry so neighbouring polygons share
+    -- pages (this is osm2pgsql's default, spelled out since lookups rely on it)
+    cluster = 'auto',
+    -- SP-GiST handles the heavily overlapping boundary polygons better than
+    -- GiST for point-in-polygon lookups (requires PostgreSQL 11+ / PostGIS 2.5+)
+    indexes = {
+        { column = 'geom', method = 'spgist' },
+    }
 })
 
 -- Process relations with boundary=administrative tag
@@ -47,7 +47,16 @@ if [ ! -f "bin/2-admin-boundaries.lua" ]; then
     exit 1
 fi
 
-# Import the data using osm2pgsql with the flex output
+# Check if the reverse geocoding SQL function file exists
+if [ ! -f "bin/2-reverse-geo.sql" ]; then
+    echo "Error: SQL function file bin/2-reverse-geo.sql not found."
+    echo "Please make sure the SQL function file exists."
+    exit 1
+fi
+
+# Import the data using osm2pgsql with the flex output. osm2pgsql loads the
+# table with COPY and sorts it by geometry; --drop removes the slim mode
+# tables once the import is done since the boundaries are never updated
 echo "Importing administrative boundaries into PostgreSQL..."
 osm2pgsql \
     --database $DB_NAME \
@@ -56,12 +65,19 @@ osm2pgsql \
     --hstore-all \
     --keep-coastlines \
     --slim \
+    --drop \
     data/admin-boundaries.osm.pbf
 
 echo "Creating indexes for better query performance..."
 psql -d $DB_NAME -c "CREATE INDEX IF NOT EXISTS boundaries_admin_level_idx ON boundaries (admin_level);"
 psql -d $DB_NAME -c "CREATE INDEX IF NOT EXISTS boundaries_name_idx ON boundaries (name);"
-psql -d $DB_NAME -c "CREATE INDEX IF NOT EXISTS boundaries_geom_idx ON boundaries USING GIST (geom);"
+psql -d $DB_NAME -c "CREATE INDEX IF NOT EXISTS boundaries_geom_idx ON boundaries USING SPGIST (geom);"
+
+echo "Updating planner statistics and the visibility map..."
+psql -d $DB_NAME -c "VACUUM ANALYZE boundaries;"
+
+echo "Creating the reverse_geo() lookup function..."
+psql -d $DB_NAME -f bin/2-reverse-geo.sql
 
 echo "Import completed successfully!"
 echo "You can now query administrative boundaries from the 'boundaries' table in the '$DB_NAME' database." 
\ No newline at end of file
@@ -0,0 +1,60 @@
+-- Reverse geocoding function for the boundaries table
+--
+-- Returns the country (admin_level 2), state (admin_level 4) and city
+-- (admin_level 8, falling back to 9 then 7) containing the point, along with
+-- every matching boundary of those levels, so a lookup is a single
+-- round-trip:
+--
+--   SELECT reverse_geo(48.7331439, 1.3615715);
+
+CREATE OR REPLACE FUNCTION reverse_geo(lat double precision, lon double precision)
+RETURNS jsonb
+LANGUAGE plpgsql
+STABLE PARALLEL SAFE
+AS $$
+DECLARE
+    -- NOTE: ST_Point(x, y) => x=lon, y=lat
+    pt geometry := ST_SetSRID(ST_Point(lon, lat), 4326);
+    boundary RECORD;
+    country text;
+    state text;
+    city_7 text;
+    city_8 text;
+    city_9 text;
+    admin_levels jsonb := '[]'::jsonb;
+BEGIN
+    FOR boundary IN
+        SELECT b.admin_level, b.name
+        FROM boundaries b
+        -- The && bounding box test is answered by the spatial index and
+        -- leaves only a few candidates for the exact ST_Contains check
+        WHERE b.geom && pt
+          -- Only the levels used below
+          AND b.admin_level IN (2, 4, 7, 8, 9)
+          AND ST_Contains(b.geom, pt)
+        ORDER BY b.admin_level
+    LOOP
+        admin_levels := admin_levels || jsonb_build_object(
+            'admin_level', boundary.admin_level,
+            'name', boundary.name
+        );
+
+        CASE boundary.admin_level
+            WHEN 2 THEN country := boundary.name;
+            WHEN 4 THEN state := boundary.name;
+            WHEN 7 THEN city_7 := boundary.name;
+            WHEN 8 THEN city_8 := boundary.name;
+            WHEN 9 THEN city_9 := boundary.name;
+            ELSE NULL;
+        END CASE;
+    END LOOP;
+
+    RETURN jsonb_build_object(
+        'country', country,
+        'state', state,
+        -- Prefer level 8, then 9, then 7
+        'city', COALESCE(NULLIF(city_8, ''), NULLIF(city_9, ''), NULLIF(city_7, '')),
+        'admin_levels', admin_levels
+    );
+END;
+$$;
@@ -4,128 +4,121 @@ import sys
 import json
 import psycopg2
 import os
-import reverse_geocoder as rg
-import pycountry
-import argparse
+import atexit
+import weakref
+import threading
+from psycopg2 import pool
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
 
-# Initialize reverse_geocoder once at module level to avoid reloading the dataset on each call
-# Set mode to 2 for faster performance (using kdtree)
-rg_search = rg.RGeocoder(mode=2, verbose=False)
+# Import the nearest city lookup used as a fallback, the database host
+# lookup and the country names from the bin directory
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import cities_index
+from database import get_database_host
+from countries import get_country_code, get_country_name
 
-def get_country_code(country_name):
-    """
-    Try to find the ISO country code for a given country name using pycountry.
-    Returns None if not found.
-    """
-    try:
-        # Try direct lookup
-        country = pycountry.countries.get(name=country_name)
-        if country:
-            return country.alpha_2
-        
-        # Try fuzzy search if direct lookup fails
-        countries = pycountry.countries.search_fuzzy(country_name)
-        if countries:
-            return countries[0].alpha_2
-    except (AttributeError, LookupError):
-        # Handle cases where the country name isn't recognized
-        pass
-    
-    return None
 
-def get_administrative_boundaries(lat, lon, debug=False):
+# Process-wide connection pool, shared by every lookup so each call doesn't
+# pay for a fresh TCP connection and authentication handshake
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+# Maximum number of connections checked out of the pool at once
+MAX_CONNECTIONS = 25
+
+# Number of coordinates looked up per query in batch mode
+BATCH_SIZE = 500
+
+# LRU cache of reverse_geo() results, keyed on coordinates rounded to
+# CACHE_PRECISION decimal places (about 11 meters at the equator) so that
+# repeated or nearby lookups skip the database
+CACHE_PRECISION = 4
+CACHE_SIZE = 4096
+_boundaries_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def get_connection_pool():
+    """Get or create the process-wide connection pool."""
+    global _POOL
+    if _POOL is None:
+        # Batch queries run in worker threads that can all ask for the pool
+        # at once: only let the first one create it
+        with _POOL_LOCK:
+            if _POOL is None:
+                # Adjust these to match your database credentials:
+                dbname = "reverse_geo"
+                dbuser = os.environ.get("USER", "gabin")  # Use system username instead of postgres
+                dbpass = ""               # fill in if you require a password
+                dbport = 5432             # or your DB port
+                dbhost = get_database_host(dbport)  # or your DB host
+
+                _POOL = pool.ThreadedConnectionPool(
+                    1, MAX_CONNECTIONS,
+                    dbname=dbname,
+                    user=dbuser,
+                    password=dbpass,
+                    host=dbhost,
+                    port=dbport
+                )
+                atexit.register(_POOL.closeall)
+    return _POOL
+
+# Pooled connections on which reverse_geo_q has already been prepared
+_prepared_connections = weakref.WeakSet()
+
+def prepare_statements(connection):
     """
-    Returns a JSON string with structured administrative boundaries
-    containing the point (lat, lon).
+    Prepare the reverse_geo() lookup on a connection, once per session,
+    so that each lookup skips parsing and planning the query.
     """
-    # Adjust these to match your database credentials:
-    dbname = "reverse_geo"
-    dbuser = os.environ.get("USER", "gabin")  # Use system username instead of postgres
-    dbpass = ""               # fill in if you require a password
-    dbhost = "localhost"      # or your DB host
-    dbport = 5432             # or your DB port
-
-    connection = psycopg2.connect(
-        dbname=dbname,
-        user=dbuser,
-        password=dbpass,
-        host=dbhost,
-        port=dbport
-    )
+    if connection in _prepared_connections:
+        return
+
     cursor = connection.cursor()
 
-    # NOTE: ST_Point(x, y) => x=lon, y=lat
-    query = """
-        SELECT admin_level, name
-        FROM boundaries
-        WHERE ST_Contains(
-            geom,
-            ST_SetSRID(ST_Point(%s, %s), 4326)
-        )
-        ORDER BY admin_level::int;
-    """
+    # reverse_geo() is defined in bin/2-reverse-geo.sql
+    cursor.execute("""
+        PREPARE reverse_geo_q(float8, float8) AS
+        SELECT reverse_geo($1, $2);
+    """)
+    cursor.close()
+    connection.commit()
 
-    # We pass (lon, lat) since ST_Point expects (x=lon, y=lat).
-    cursor.execute(query, (lon, lat))
-    rows = cursor.fetchall()
+    _prepared_connections.add(connection)
 
+def build_result(boundaries, lat, lon, debug=False):
+    """
+    Builds the result structure for the point (lat, lon) from the
+    boundaries returned by reverse_geo().
+    """
     if debug:
         print(f"DEBUG: Database query for coordinates ({lat}, {lon})")
-        print(f"DEBUG: Found {len(rows)} administrative boundaries")
+        print(f"DEBUG: Found {len(boundaries['admin_levels'])} administrative boundaries")
         print("DEBUG: Raw database results:")
-        for admin_level, name in rows:
-            print(f"DEBUG:   admin_level={admin_level}, name={name}")
-
-    cursor.close()
-    connection.close()
+        for boundary in boundaries["admin_levels"]:
+            print(f"DEBUG:   admin_level={boundary['admin_level']}, name={boundary['name']}")
 
-    # Initialize result structure
+    # Initialize result structure, the country, state and city have already
+    # been picked by reverse_geo()
     result = {
         "countryCode": None,
-        "country": None,
-        "state": None,
-        "city": None
-    }
-    
-    # Track if we have admin_level 2 (country)
-    has_admin_level_2 = False
-    
-    # Store city candidates from different admin levels
-    city_candidates = {
-        7: None,
-        8: None,
-        9: None
+        "country": boundaries["country"],
+        "state": boundaries["state"],
+        "city": boundaries["city"]
     }
     
     # Store all admin levels for debug output
-    all_admin_levels = {}
-    
-    # Process database results
-    for admin_level, name in rows:
-        # Convert admin_level to int if it's a string
-        admin_level_int = int(admin_level) if isinstance(admin_level, str) else admin_level
-        
-        # Store all admin levels for debug
-        all_admin_levels[admin_level_int] = name
-        
-        # Assign values to the appropriate fields
-        if admin_level_int == 2:
-            result["country"] = name
-            # Try to get country code using pycountry
-            result["countryCode"] = get_country_code(name)
-            has_admin_level_2 = True
-        elif admin_level_int == 4:
-            result["state"] = name
-        elif admin_level_int in [7, 8, 9]:
-            city_candidates[admin_level_int] = name
+    all_admin_levels = {
+        boundary["admin_level"]: boundary["name"]
+        for boundary in boundaries["admin_levels"]
+    }
     
-    # Apply city selection logic: prefer level 8, then 9, then 7
-    if city_candidates[8]:
-        result["city"] = city_candidates[8]
-    elif city_candidates[9]:
-        result["city"] = city_candidates[9]
-    elif city_candidates[7]:
-        result["city"] = city_candidates[7]
+    # Track if we have admin_level 2 (country)
+    has_admin_level_2 = 2 in all_admin_levels
+    if has_admin_level_2:
+        # Try to get country code using pycountry
+        result["countryCode"] = get_country_code(result["country"])
     
     if debug:
         print("DEBUG: After processing database results:")
@@ -133,7 +126,7 @@ def get_administrative_boundaries(lat, lon, debug=False):
         print(f"DEBUG:   country={result['country']}")
         print(f"DEBUG:   state={result['state']}")
         print(f"DEBUG:   city={result['city']}")
-        print(f"DEBUG:   city candidates: level 7={city_candidates[7]}, level 8={city_candidates[8]}, level 9={city_candidates[9]}")
+        print(f"DEBUG:   city candidates: level 7={all_admin_levels.get(7)}, level 8={all_admin_levels.get(8)}, level 9={all_admin_levels.get(9)}")
         print("DEBUG:   All admin levels found in PostgreSQL:")
         for level in sorted(all_admin_levels.keys()):
             print(f"DEBUG:     admin_level={level}, name={all_admin_levels[level]}")
@@ -145,7 +138,7 @@ def get_administrative_boundaries(lat, lon, debug=False):
         print(f"{use_reason}. Using reverse_geocoder for country lookup...")
         
         # reverse_geocoder expects coordinates as (lat, lon)
-        rg_result = rg_search.query([(lat, lon)])[0]
+        rg_result = cities_index.query([(lat, lon)])[0]
         print("Raw reverse_geocoder country result:")
         print(f"Country Code: {rg_result['cc']}")
         
@@ -159,17 +152,8 @@ def get_administrative_boundaries(lat, lon, debug=False):
         
         # If we don't have a country name yet, use the one from reverse_geocoder
         if not result["country"]:
-            # Try to get full country name from country code
-            try:
-                country = pycountry.countries.get(alpha_2=rg_result['cc'])
-                if country:
-                    result["country"] = country.name
-                else:
-                    # Fallback to just using the country code
-                    result["country"] = rg_result['cc']
-            except (AttributeError, LookupError):
-                # Fallback to just using the country code
-                result["country"] = rg_result['cc']
+            # Get full country name from country code
+            result["country"] = get_country_name(rg_result['cc'])
         
         # If city is still null, try to use the name from reverse_geocoder
         if result["city"] is None and 'name' in rg_result:
@@ -184,17 +168,195 @@ def get_administrative_boundaries(lat, lon, debug=False):
         print(f"DEBUG:   state={result['state']}")
         print(f"DEBUG:   city={result['city']}")
     
+    return result
+
+def get_cached_boundaries(cache_key):
+    """Returns the cached reverse_geo() result for cache_key, or None."""
+    with _cache_lock:
+        boundaries = _boundaries_cache.get(cache_key)
+        if boundaries is not None:
+            _boundaries_cache.move_to_end(cache_key)
+        return boundaries
+
+def cache_boundaries(cache_key, boundaries):
+    """Caches a reverse_geo() result, evicting the least recently used one."""
+    with _cache_lock:
+        _boundaries_cache[cache_key] = boundaries
+        _boundaries_cache.move_to_end(cache_key)
+        if len(_boundaries_cache) > CACHE_SIZE:
+            _boundaries_cache.popitem(last=False)
+
+def query_boundaries(lat, lon):
+    """
+    Runs reverse_geo() for the point (lat, lon) on a pooled connection.
+    """
+    # Get a connection from the pool
+    connection_pool = get_connection_pool()
+    connection = connection_pool.getconn()
+
+    try:
+        prepare_statements(connection)
+        cursor = connection.cursor()
+
+        # reverse_geo() takes (lat, lon) and returns the boundaries as jsonb,
+        # which psycopg2 decodes into a dict
+        cursor.execute("EXECUTE reverse_geo_q(%s, %s);", (lat, lon))
+        boundaries = cursor.fetchone()[0]
+
+        cursor.close()
+    finally:
+        # Return the connection to the pool
+        connection_pool.putconn(connection)
+
+    return boundaries
+
+def get_administrative_boundaries(lat, lon, debug=False):
+    """
+    Returns a JSON string with structured administrative boundaries
+    containing the point (lat, lon).
+    """
+    # Round coordinates for better cache hits
+    cache_key = (round(lat, CACHE_PRECISION), round(lon, CACHE_PRECISION))
+
+    boundaries = get_cached_boundaries(cache_key)
+    if boundaries is None:
+        boundaries = query_boundaries(*cache_key)
+        cache_boundaries(cache_key, boundaries)
+
+    result = build_result(boundaries, lat, lon, debug)
+    
     # Return the structured JSON
     return json.dumps(result, indent=2)
 
+def query_batch(coordinates):
+    """
+    Runs reverse_geo() for a list of (lat, lon) tuples in a single query
+    on a pooled connection, and returns the boundaries in the same order.
+    """
+    lats = [lat for lat, lon in coordinates]
+    lons = [lon for lat, lon in coordinates]
+
+    # Get a connection from the pool
+    connection_pool = get_connection_pool()
+    connection = connection_pool.getconn()
+
+    try:
+        cursor = connection.cursor()
+
+        # Look up every point in one round-trip, keeping the input order
+        cursor.execute("""
+            SELECT reverse_geo(t.lat, t.lon)
+            FROM unnest(%s::float8[], %s::float8[]) WITH ORDINALITY AS t(lat, lon, idx)
+            ORDER BY t.idx;
+        """, (lats, lons))
+        rows = cursor.fetchall()
+
+        cursor.close()
+    finally:
+        # Return the connection to the pool
+        connection_pool.putconn(connection)
+
+    return [boundaries for (boundaries,) in rows]
+
+def batch_reverse_geocode(coordinates, debug=False):
+    """
+    Process multiple coordinates, BATCH_SIZE points per database query.
+    
+    Only distinct rounded coordinates that aren't cached yet are sent to
+    the database.
+    
+    Args:
+        coordinates: List of (lat, lon) tuples
+        debug: Whether to print debug information
+        
+    Returns:
+        List of JSON results, in the same order as coordinates
+    """
+    cache_keys = [
+        (round(lat, CACHE_PRECISION), round(lon, CACHE_PRECISION))
+        for lat, lon in coordinates
+    ]
+
+    # Boundaries for every distinct rounded coordinate
+    found = {}
+    missing = []
+    for cache_key in dict.fromkeys(cache_keys):
+        boundaries = get_cached_boundaries(cache_key)
+        if boundaries is None:
+            missing.append(cache_key)
+        else:
+            found[cache_key] = boundaries
+
+    chunks = [missing[i:i + BATCH_SIZE] for i in range(0, len(missing), BATCH_SIZE)]
+
+    # Queries for separate chunks are independent, so run them concurrently,
+    # each on its own pooled connection
+    max_workers = max(1, min(len(chunks), MAX_CONNECTIONS))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for chunk, chunk_boundaries in zip(chunks, executor.map(query_batch, chunks)):
+            for cache_key, boundaries in zip(chunk, chunk_boundaries):
+                cache_boundaries(cache_key, boundaries)
+                found[cache_key] = boundaries
+
+    results = []
+    for cache_key, (lat, lon) in zip(cache_keys, coordinates):
+        result = build_result(found[cache_key], lat, lon, debug)
+        results.append(json.dumps(result, indent=2))
+    
+    return results
+
 if __name__ == "__main__":
+    # Fast path for the common `<latitude> <longitude>` invocation, which
+    # skips importing and running argparse
+    if len(sys.argv) == 3:
+        try:
+            lat, lon = float(sys.argv[1]), float(sys.argv[2])
+        except ValueError:
+            pass
+        else:
+            print(get_administrative_boundaries(lat, lon))
+            sys.exit(0)
+    
+    import argparse
+    
     parser = argparse.ArgumentParser(description='Reverse geocoding script')
-    parser.add_argument('latitude', type=float, help='Latitude coordinate')
-    parser.add_argument('longitude', type=float, help='Longitude coordinate')
+    parser.add_argument('latitude', type=float, nargs='?', help='Latitude coordinate')
+    parser.add_argument('longitude', type=float, nargs='?', help='Longitude coordinate')
     parser.add_argument('--debug', action='store_true', help='Enable debug output')
+    parser.add_argument('--batch', action='store_true', help='Enable batch mode (read coordinates from stdin)')
     
     args = parser.parse_args()
 
-    # Get the JSON of boundaries
-    boundaries_json = get_administrative_boundaries(args.latitude, args.longitude, args.debug)
-    print(boundaries_json)
\ No newline at end of file
+    if args.batch:
+        # Batch mode: read coordinates from stdin, one per line
+        print("Enter coordinates as 'latitude longitude', one per line. End with Ctrl+D (Unix) or Ctrl+Z (Windows):")
+        coordinates = []
+        try:
+            for line in sys.stdin:
+                line = line.strip()
+                if not line:
+                    continue
+                parts = line.split()
+                if len(parts) >= 2:
+                    try:
+                        lat, lon = float(parts[0]), float(parts[1])
+                        coordinates.append((lat, lon))
+                    except ValueError:
+                        print(f"Warning: Could not parse coordinates from line: {line}", file=sys.stderr)
+        except KeyboardInterrupt:
+            pass
+        
+        if coordinates:
+            results = batch_reverse_geocode(coordinates, args.debug)
+            for i, result in enumerate(results):
+                print(f"\nResult for coordinate {i+1} ({coordinates[i][0]}, {coordinates[i][1]}):")
+                print(result)
+        else:
+            print("No valid coordinates provided.")
+    else:
+        if args.latitude is None or args.longitude is None:
+            parser.error("latitude and longitude are required unless --batch is given")
+
+        # Get the JSON of boundaries
+        boundaries_json = get_administrative_boundaries(args.latitude, args.longitude, args.debug)
+        print(boundaries_json)
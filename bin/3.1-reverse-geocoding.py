@@ -1,39 +1,38 @@
 #!/usr/bin/env python3
 
 import sys
-import json
-import argparse
-import reverse_geocoder as rg
-import pycountry
-from functools import lru_cache
+import os
+import functools
+import numpy as np
+import orjson
 
-# Initialize reverse_geocoder once at module level to avoid reloading the dataset on each call
-# Set mode to 2 for faster performance (using kdtree)
-rg_search = rg.RGeocoder(mode=2, verbose=False)
+# Import the nearest city lookup and the country names from the bin directory
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import cities_index
+from countries import get_country_name
 
-@lru_cache(maxsize=128)
-def get_country_name(country_code):
+# Single lookups are cached on coordinates rounded to CACHE_PRECISION
+# decimal places (about 11 meters at the equator), so repeated or nearby
+# points skip the K-D tree
+CACHE_PRECISION = 4
+CACHE_SIZE = 200_000
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def get_nearest_city(lat, lon):
     """
-    Get the full country name from a country code.
-    Uses lru_cache for efficiency when processing multiple points.
+    Cached nearest city lookup for a rounded point. The returned dict is
+    shared between calls and must not be modified.
     """
-    try:
-        country = pycountry.countries.get(alpha_2=country_code)
-        if country:
-            return country.name
-    except (AttributeError, LookupError):
-        pass
-    
-    # Return the country code if we can't find the full name
-    return country_code
+    return cities_index.query([(lat, lon)])[0]
 
 def get_administrative_boundaries(lat, lon, debug=False):
     """
     Returns a JSON string with structured administrative boundaries
-    containing the point (lat, lon) using only reverse_geocoder.
+    containing the point (lat, lon) using only the reverse_geocoder
+    cities dataset.
     """
-    # Query the reverse geocoder (expects coordinates as (lat, lon))
-    rg_result = rg_search.query([(lat, lon)])[0]
+    # Query the cities index (expects coordinates as (lat, lon))
+    rg_result = get_nearest_city(round(lat, CACHE_PRECISION), round(lon, CACHE_PRECISION))
     
     if debug:
         print("DEBUG: Full reverse_geocoder result:")
@@ -56,7 +55,7 @@ def get_administrative_boundaries(lat, lon, debug=False):
         print(f"DEBUG:   city={result['city']}")
     
     # Return the structured JSON
-    return json.dumps(result, indent=2)
+    return orjson.dumps(result, option=orjson.OPT_INDENT_2).decode()
 
 def batch_process(coordinates, debug=False):
     """
@@ -69,12 +68,23 @@ def batch_process(coordinates, debug=False):
     Returns:
         List of JSON results
     """
-    # Query all coordinates in a single batch
-    rg_results = rg_search.query(coordinates)
+    # Find the nearest city for all coordinates in a single K-D tree query,
+    # spread over every CPU
+    _, columns = cities_index.load_index()
+    indices = cities_index.nearest(coordinates, workers=-1)
+    
+    # Gather and decode each column for all the points at once
+    country_codes = np.char.decode(columns["cc"][indices], 'utf-8').tolist()
+    states = np.char.decode(columns["admin1"][indices], 'utf-8').tolist()
+    cities = np.char.decode(columns["name"][indices], 'utf-8').tolist()
+    
+    # Only a few hundred country codes exist, so look each one up only once
+    country_names = {code: get_country_name(code) for code in set(country_codes)}
     
     results = []
-    for rg_result in rg_results:
+    for i, index in enumerate(indices):
         if debug:
+            rg_result = cities_index.get_city(index)
             print(f"\nDEBUG: Processing coordinate ({rg_result['lat']}, {rg_result['lon']})")
             print("DEBUG: Reverse_geocoder result:")
             for key, value in rg_result.items():
@@ -82,10 +92,10 @@ def batch_process(coordinates, debug=False):
         
         # Build the result structure
         result = {
-            "countryCode": rg_result['cc'],
-            "country": get_country_name(rg_result['cc']),
-            "state": rg_result['admin1'],
-            "city": rg_result['name']
+            "countryCode": country_codes[i],
+            "country": country_names[country_codes[i]],
+            "state": states[i],
+            "city": cities[i]
         }
         
         if debug:
@@ -95,11 +105,24 @@ def batch_process(coordinates, debug=False):
             print(f"DEBUG:   state={result['state']}")
             print(f"DEBUG:   city={result['city']}")
         
-        results.append(json.dumps(result, indent=2))
+        results.append(orjson.dumps(result, option=orjson.OPT_INDENT_2).decode())
     
     return results
 
 if __name__ == "__main__":
+    # Fast path for the common `<latitude> <longitude>` invocation, which
+    # skips importing and running argparse
+    if len(sys.argv) == 3:
+        try:
+            lat, lon = float(sys.argv[1]), float(sys.argv[2])
+        except ValueError:
+            pass
+        else:
+            print(get_administrative_boundaries(lat, lon))
+            sys.exit(0)
+    
+    import argparse
+    
     parser = argparse.ArgumentParser(description='Efficient reverse geocoding script using only reverse_geocoder')
     parser.add_argument('latitude', type=float, help='Latitude coordinate')
     parser.add_argument('longitude', type=float, help='Longitude coordinate')
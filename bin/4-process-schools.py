@@ -1,26 +1,36 @@
 #!/usr/bin/env python3
 
-import json
+import orjson
 import os
 import sys
-import time
 from tqdm import tqdm
 import argparse
-import multiprocessing
-from functools import partial
-import queue
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
 
 # Import the reverse geocoding function from the existing script
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from reverse_geocoding import get_administrative_boundaries
+from reverse_geocoding import (
+    _get_administrative_boundaries_dict, get_administrative_boundaries_batch, MAX_CONNECTIONS,
+    enable_persistent_cache, flush_persistent_cache, get_connection_pool
+)
 
-def process_school(school, debug=False):
+# Number of schools looked up with a single database query
+BATCH_SIZE = 500
+
+def get_osm_id(school):
+    """Returns the OSM ID of a school, e.g. N123 for node 123."""
+    osm_data = school.get('osm', {})
+    return f"{osm_data.get('type', 'N')[0].upper()}{osm_data.get('id', 0)}"
+
+def process_school(school, debug=False, address=None):
     """
     Process a single school and return the result.
     
     Args:
         school: School data dictionary
         debug: Whether to enable debug output
+        address: Address dict already looked up for the school, if any
     
     Returns:
         Tuple of (osm_id, result_dict)
@@ -29,8 +39,8 @@ def process_school(school, debug=False):
     name = school.get('name', 'Unknown')
     lat = school.get('latitude')
     lon = school.get('longitude')
-    osm_data = school.get('osm', {})
-    osm_id = f"{osm_data.get('type', 'N')[0].upper()}{osm_data.get('id', 0)}"
+    # Reuse the OSM ID computed when filtering the schools to process
+    osm_id = school.get('_osm_id') or get_osm_id(school)
     
     # Skip if missing coordinates
     if lat is None or lon is None:
@@ -40,8 +50,16 @@ def process_school(school, debug=False):
     
     # Get address information using reverse geocoding
     try:
-        address_json = get_administrative_boundaries(lat, lon, debug)
-        address = json.loads(address_json)
+        if address is None:
+            address = _get_administrative_boundaries_dict(lat, lon)
+        
+        if debug:
+            print(f"DEBUG: Lookup for school '{name}' at coordinates ({lat}, {lon})")
+            print("DEBUG: Final result:")
+            print(f"DEBUG:   countryCode={address.get('countryCode')}")
+            print(f"DEBUG:   country={address.get('country')}")
+            print(f"DEBUG:   state={address.get('state')}")
+            print(f"DEBUG:   city={address.get('city')}")
         
         # Create result dictionary
         result = {
@@ -72,45 +90,156 @@ def process_school(school, debug=False):
             }
         })
 
-def result_collector(result_queue, output_file, total_to_process, debug=False, save_interval=100):
+def process_school_batch(schools, debug=False):
     """
-    Collect results from worker processes and save them periodically.
+    Process a batch of schools, looking up all their addresses with a
+    single database query.
     
     Args:
-        result_queue: Queue to receive results from workers
-        output_file: Path to the output JSON file
-        total_to_process: Total number of schools being processed
+        schools: List of school data dictionaries
+        debug: Whether to enable debug output
+    
+    Returns:
+        List with the result of process_school for each school
+    """
+    has_coordinates = [
+        school.get('latitude') is not None and school.get('longitude') is not None
+        for school in schools
+    ]
+    coordinates = [
+        (school['latitude'], school['longitude'])
+        for school, located in zip(schools, has_coordinates) if located
+    ]
+    
+    try:
+        addresses = iter(get_administrative_boundaries_batch(coordinates))
+    except Exception as e:
+        if debug:
+            print(f"Error looking up a batch of {len(coordinates)} schools: {str(e)}")
+        # Fall back to looking up the schools one by one
+        addresses = None
+    
+    results = []
+    for school, located in zip(schools, has_coordinates):
+        address = next(addresses) if located and addresses is not None else None
+        results.append(process_school(school, debug, address))
+    return results
+
+def process_schools(input_file, output_file, debug=False, save_interval=100, num_workers=None, cache_file=None, legacy_file=None):
+    """
+    Process schools data from input_file, add address information using reverse geocoding,
+    and append the results to output_file using multiple threads.
+    
+    Args:
+        input_file: Path to the input JSON file containing schools data
+        output_file: Path to the output NDJSON file for saving results, one
+            {"osm_id": ..., "data": ...} object per line
         debug: Whether to enable debug output
         save_interval: Number of schools to process before saving progress
+        num_workers: Number of worker threads to use (defaults to 4 per CPU)
+        cache_file: SQLite file keeping reverse geocoding results across runs (disabled if None)
+        legacy_file: JSON output of older versions of this script, imported
+            into output_file if it doesn't exist yet
     """
-    # Initialize result dictionary
-    result = {}
+    # Lookups mostly wait on PostgreSQL, so use several threads per CPU,
+    # but no more than the connection pool can serve at once
+    if num_workers is None:
+        num_workers = (os.cpu_count() or 1) * 4
+    num_workers = max(1, min(num_workers, MAX_CONNECTIONS))
+    
+    print(f"Using {num_workers} worker threads")
+    
+    # Reuse the reverse geocoding results of previous runs
+    if cache_file:
+        print(f"Using reverse geocoding cache {cache_file}")
+        enable_persistent_cache(cache_file)
+    
+    # Load schools data
+    print(f"Loading schools data from {input_file}...")
+    try:
+        with open(input_file, 'rb') as f:
+            schools = orjson.loads(f.read())
+    except Exception as e:
+        print(f"Error loading schools data: {e}")
+        sys.exit(1)
     
-    # Check if output file exists and load existing results
+    print(f"Loaded {len(schools)} schools.")
+    
+    # Carry over the results of older versions of this script, which saved a
+    # single JSON object instead of NDJSON
+    if legacy_file and not os.path.exists(output_file) and os.path.exists(legacy_file):
+        try:
+            count = import_legacy_results(legacy_file, output_file)
+            print(f"Imported {count} already processed schools from {legacy_file} into {output_file}.")
+        except Exception as e:
+            print(f"Error importing existing results from {legacy_file}: {e}")
+            sys.exit(1)
+    
+    # Check if output file exists and read the IDs of the schools it already has
+    processed_ids = set()
     if os.path.exists(output_file):
         try:
-            with open(output_file, 'r') as f:
-                result = json.load(f)
-            if debug:
-                print(f"Collector: Loaded {len(result)} already processed schools from {output_file}.")
+            processed_ids = load_processed_ids(output_file)
+            print(f"Found {len(processed_ids)} already processed schools in {output_file}.")
         except Exception as e:
-            if debug:
-                print(f"Collector: Error loading existing results: {e}")
-                print("Collector: Starting with an empty result set.")
+            print(f"Error loading existing results: {e}")
+            sys.exit(1)
+    
+    # Filter schools that need processing, keeping their OSM ID on the
+    # school so that process_school doesn't compute it again
+    for school in schools:
+        school['_osm_id'] = get_osm_id(school)
+    schools_to_process = [school for school in schools if school['_osm_id'] not in processed_ids]
+    
+    if not schools_to_process:
+        print("All schools have already been processed. Nothing to do.")
+        return
+    
+    print(f"Processing {len(schools_to_process)} schools out of {len(schools)} total...")
     
     # Variables for tracking progress and saving
     processed_count = 0
     error_count = 0
-    last_save_time = time.time()
     
     # Create progress bar
-    pbar = tqdm(total=total_to_process, desc="Processing schools")
+    pbar = tqdm(total=len(schools_to_process), desc="Processing schools")
+    
+    # Each task looks up a batch of schools with a single database query.
+    # Worker threads share the database connection pool and the geocoding
+    # cache, and hand their results straight back to this thread
+    batches = (
+        schools_to_process[i:i + BATCH_SIZE]
+        for i in range(0, len(schools_to_process), BATCH_SIZE)
+    )
+    # Only keep a couple of batches per worker queued or running, so results
+    # don't pile up in memory when saving falls behind
+    max_pending = num_workers * 2
+    pending = set()
+    
+    # Open the database connections before starting the workers, instead of
+    # every worker connecting on its first lookup
+    try:
+        get_connection_pool()
+    except Exception as e:
+        print(f"Error connecting to the database: {e}")
     
+    # New results are appended to the output file, so saving progress only
+    # writes the schools processed since the last save
+    output = open(output_file, 'ab')
+    executor = ThreadPoolExecutor(max_workers=num_workers)
     try:
-        while processed_count < total_to_process:
-            try:
-                # Get result with timeout to allow for keyboard interrupts
-                item = result_queue.get(timeout=1)
+        while True:
+            for batch in islice(batches, max_pending - len(pending)):
+                pending.add(executor.submit(process_school_batch, batch, debug))
+            if not pending:
+                break
+            
+            # Handle the batches as soon as they finish, in any order, so a
+            # slow batch doesn't keep the workers waiting for new ones
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            items = [item for future in done for item in future.result()]
+            for item in items:
+                pbar.update(1)
                 
                 if item is None:
                     # Skip None results (schools with missing coordinates)
@@ -118,145 +247,123 @@ def result_collector(result_queue, output_file, total_to_process, debug=False, s
                 
                 osm_id, school_result = item
                 
-                # Add to result dictionary
-                result[osm_id] = school_result
+                # Add to the output file
+                output.write(orjson.dumps({"osm_id": osm_id, "data": school_result}) + b"\n")
                 
                 # Check if there was an error
                 if "error" in school_result:
                     error_count += 1
                 
                 processed_count += 1
-                pbar.update(1)
                 
-                # Save progress periodically
-                if (processed_count % save_interval == 0 or 
-                    time.time() - last_save_time > 60):  # Save every minute or every save_interval schools
-                    save_results(result, output_file, debug)
-                    last_save_time = time.time()
-                    
-            except queue.Empty:
-                # No results available, just continue
-                continue
+                # Save progress every save_interval schools
+                if processed_count % save_interval == 0:
+                    save_results(output, debug)
     except KeyboardInterrupt:
-        print("\nCollector: Interrupted by user. Saving current progress...")
+        print("\nInterrupted by user. Saving current progress...")
     finally:
+        # Don't start the schools that are still queued
+        executor.shutdown(wait=False, cancel_futures=True)
+        
         # Final save
+        save_results(output, debug)
+        output.close()
         if processed_count > 0:
-            save_results(result, output_file, debug)
             print(f"\nSuccessfully processed {processed_count} schools.")
             if error_count > 0:
                 print(f"Encountered errors with {error_count} schools.")
         
         pbar.close()
 
-def process_schools(input_file, output_file, debug=False, save_interval=100, num_workers=None):
+# Every line of the NDJSON output starts with this, as written by orjson
+RECORD_PREFIX = b'{"osm_id":'
+
+def parse_record(line):
     """
-    Process schools data from input_file, add address information using reverse geocoding,
-    and save the results to output_file using multiple processes.
-    
-    Args:
-        input_file: Path to the input JSON file containing schools data
-        output_file: Path to the output JSON file for saving results
-        debug: Whether to enable debug output
-        save_interval: Number of schools to process before saving progress
-        num_workers: Number of worker processes to use (defaults to CPU count)
+    Returns the OSM ID of an {"osm_id": ..., "data": ...} line of the NDJSON
+    output, or None if the line isn't one.
     """
-    # Determine number of workers
-    if num_workers is None:
-        num_workers = max(1, multiprocessing.cpu_count() - 1)  # Leave one CPU for the main process
-    
-    print(f"Using {num_workers} worker processes")
-    
-    # Load schools data
-    print(f"Loading schools data from {input_file}...")
     try:
-        with open(input_file, 'r') as f:
-            schools = json.load(f)
-    except Exception as e:
-        print(f"Error loading schools data: {e}")
-        sys.exit(1)
-    
-    print(f"Loaded {len(schools)} schools.")
+        record = orjson.loads(line)
+    except orjson.JSONDecodeError:
+        return None
+    if not isinstance(record, dict) or "osm_id" not in record or "data" not in record:
+        return None
+    return record["osm_id"]
+
+def load_processed_ids(output_file):
+    """
+    Returns the OSM IDs of the schools already saved to the NDJSON output
+    file, reading it one line at a time.
     
-    # Check if output file exists and load existing results to determine which schools to process
+    A last record cut short by an interrupted run is removed from the file,
+    so that new results can be appended after the complete ones. Raises a
+    ValueError, without modifying the file, if it isn't an NDJSON output file
+    (e.g. the JSON written by older versions of this script).
+    """
     processed_ids = set()
-    if os.path.exists(output_file):
-        try:
-            with open(output_file, 'r') as f:
-                result = json.load(f)
-            processed_ids = set(result.keys())
-            print(f"Loaded {len(processed_ids)} already processed schools from {output_file}.")
-        except Exception as e:
-            print(f"Error loading existing results: {e}")
-            print("Starting with an empty result set.")
+    complete_size = 0
     
-    # Filter schools that need processing
-    schools_to_process = []
-    for school in schools:
-        osm_data = school.get('osm', {})
-        osm_id = f"{osm_data.get('type', 'N')[0].upper()}{osm_data.get('id', 0)}"
-        
-        # Only add schools that haven't been processed yet
-        if osm_id not in processed_ids:
-            schools_to_process.append(school)
-    
-    if not schools_to_process:
-        print("All schools have already been processed. Nothing to do.")
-        return
+    with open(output_file, 'rb+') as f:
+        for line_number, line in enumerate(f, 1):
+            osm_id = parse_record(line)
+            
+            if osm_id is not None:
+                processed_ids.add(osm_id)
+                complete_size += len(line)
+                if not line.endswith(b"\n"):
+                    # Complete record without its newline, add it back
+                    f.seek(complete_size)
+                    f.write(b"\n")
+            elif not line.endswith(b"\n") and (line.startswith(RECORD_PREFIX) or RECORD_PREFIX.startswith(line)):
+                # Last record cut short by an interrupted run, possibly
+                # before its OSM ID was even written
+                f.truncate(complete_size)
+            else:
+                raise ValueError(
+                    f"line {line_number} of {output_file} is not an "
+                    '{"osm_id": ..., "data": ...} record, is it a JSON file '
+                    "from an older version? (see --legacy-output)"
+                )
     
-    print(f"Processing {len(schools_to_process)} schools out of {len(schools)} total...")
+    return processed_ids
+
+def import_legacy_results(legacy_file, output_file):
+    """
+    Converts the {osm_id: school} JSON file written by older versions of this
+    script to a new NDJSON output file, so that its schools aren't processed
+    again. The legacy file is left untouched.
     
-    # Create a queue for results
-    result_queue = multiprocessing.Queue()
+    Returns the number of schools imported.
+    """
+    with open(legacy_file, 'rb') as f:
+        result = orjson.loads(f.read())
+    if not isinstance(result, dict):
+        raise ValueError(f"{legacy_file} is not a JSON object of schools")
     
-    # Start the result collector process
-    collector_process = multiprocessing.Process(
-        target=result_collector,
-        args=(result_queue, output_file, len(schools_to_process), debug, save_interval)
-    )
-    # Set daemon to False to avoid the "daemonic processes are not allowed to have children" error
-    collector_process.daemon = False
-    collector_process.start()
+    # Write to a temporary file first so an interrupted import doesn't leave
+    # a partial output file behind
+    temp_file = f"{output_file}.tmp"
+    with open(temp_file, 'wb') as f:
+        for osm_id, school_result in result.items():
+            f.write(orjson.dumps({"osm_id": osm_id, "data": school_result}) + b"\n")
+    os.replace(temp_file, output_file)
     
-    # Create a pool of worker processes
-    try:
-        # Process schools in chunks to avoid creating too many processes
-        chunk_size = 100  # Process 100 schools at a time
-        for i in range(0, len(schools_to_process), chunk_size):
-            chunk = schools_to_process[i:i+chunk_size]
-            
-            # Process this chunk with a fresh pool
-            with multiprocessing.Pool(num_workers) as pool:
-                # Process schools in parallel
-                process_func = partial(process_school, debug=debug)
-                for result in pool.imap_unordered(process_func, chunk):
-                    if result is not None:
-                        result_queue.put(result)
-    except KeyboardInterrupt:
-        print("\nInterrupted by user. Waiting for workers to finish...")
-    finally:
-        # Signal that no more results will be coming
-        result_queue.put(None)
-        
-        # Wait for the collector to finish
-        collector_process.join()
+    return len(result)
 
-def save_results(result, output_file, debug=False):
-    """Save the current results to the output file."""
+def save_results(output, debug=False):
+    """Save the results written so far to the output file."""
     if debug:
-        print(f"Saving progress to {output_file}...")
+        print(f"Saving progress to {output.name}...")
     
-    # Create a temporary file to avoid data loss if the script is interrupted during saving
-    temp_file = f"{output_file}.tmp"
     try:
-        with open(temp_file, 'w') as f:
-            json.dump(result, f, indent=2)
+        output.flush()
         
-        # Rename the temporary file to the actual output file
-        os.replace(temp_file, output_file)
+        # Save the new reverse geocoding results along with the schools
+        flush_persistent_cache()
         
         if debug:
-            print(f"Successfully saved {len(result)} schools with address information.")
+            print("Successfully saved schools with address information.")
     except Exception as e:
         print(f"Error saving results: {e}")
         # Don't exit, just continue processing
@@ -264,11 +371,13 @@ def save_results(result, output_file, debug=False):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Process schools data and add address information')
     parser.add_argument('--input', default='data/schools.json', help='Input JSON file containing schools data')
-    parser.add_argument('--output', default='data/schools-with-addresses.json', help='Output JSON file for schools with addresses')
+    parser.add_argument('--output', default='data/schools-with-addresses.ndjson', help='Output NDJSON file for schools with addresses (see 4.1-ndjson-to-json.py)')
     parser.add_argument('--debug', action='store_true', help='Enable debug output')
     parser.add_argument('--save-interval', type=int, default=100, help='Number of schools to process before saving progress')
-    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes to use (defaults to CPU count)')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker threads to use (defaults to 4 per CPU)')
+    parser.add_argument('--cache', default=None, help='SQLite file keeping reverse geocoding results across runs, e.g. data/.geocache.sqlite (disabled by default, delete it after re-importing the boundaries)')
+    parser.add_argument('--legacy-output', default='data/schools-with-addresses.json', help='JSON output of older versions of this script, imported into --output if it does not exist yet (empty to disable)')
     
     args = parser.parse_args()
     
-    process_schools(args.input, args.output, args.debug, args.save_interval, args.workers) 
\ No newline at end of file
+    process_schools(args.input, args.output, args.debug, args.save_interval, args.workers, args.cache, args.legacy_output) 
\ No newline at end of file
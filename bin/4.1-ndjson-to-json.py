@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import argparse
+import orjson
+
+# Columns of the Parquet output, one row per school
+PARQUET_COLUMNS = ["osm_id", "name", "countryCode", "country", "state", "city", "error"]
+
+def read_results(input_file):
+    """
+    Reads the NDJSON file written by 4-process-schools.py into a dict
+    mapping each OSM ID to its school.
+    """
+    result = {}
+    with open(input_file, 'rb') as f:
+        for line in f:
+            # Skip blank lines and the last line if it was cut short
+            if not line.strip():
+                continue
+            try:
+                entry = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                continue
+            
+            # A school processed twice keeps its latest result
+            result[entry["osm_id"]] = entry["data"]
+    
+    return result
+
+def write_json(result, output_file):
+    """Writes the schools as a single JSON object keyed by OSM ID."""
+    with open(output_file, 'wb') as f:
+        f.write(orjson.dumps(result, option=orjson.OPT_INDENT_2))
+
+def write_parquet(result, output_file):
+    """
+    Writes the schools as a zstd-compressed Parquet table with one column
+    per field, which is much smaller and faster to load than the JSON.
+    """
+    # pyarrow is only needed for this format
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    
+    columns = {column: [] for column in PARQUET_COLUMNS}
+    for osm_id, school in result.items():
+        address = school.get("address", {})
+        columns["osm_id"].append(osm_id)
+        columns["name"].append(school.get("name"))
+        columns["countryCode"].append(address.get("countryCode"))
+        columns["country"].append(address.get("country"))
+        columns["state"].append(address.get("state"))
+        columns["city"].append(address.get("city"))
+        columns["error"].append(school.get("error"))
+    
+    table = pa.table({column: pa.array(values, type=pa.string()) for column, values in columns.items()})
+    pq.write_table(table, output_file, compression='zstd')
+
+def convert(input_file, output_file, output_format='json'):
+    """
+    Rebuilds the schools file from the NDJSON file written by
+    4-process-schools.py.
+    
+    Args:
+        input_file: Path to the NDJSON file, one {"osm_id": ..., "data": ...} object per line
+        output_file: Path to the output file
+        output_format: 'json' for a JSON object mapping OSM IDs to schools,
+            or 'parquet' for a table with one row per school
+    
+    Returns:
+        Number of schools written
+    """
+    result = read_results(input_file)
+    
+    # Create a temporary file to avoid leaving a partial output file behind
+    temp_file = f"{output_file}.tmp"
+    if output_format == 'parquet':
+        write_parquet(result, temp_file)
+    else:
+        write_json(result, temp_file)
+    os.replace(temp_file, output_file)
+    
+    return len(result)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert the NDJSON output of 4-process-schools.py to a single JSON object or a Parquet table')
+    parser.add_argument('--input', default='data/schools-with-addresses.ndjson', help='Input NDJSON file written by 4-process-schools.py')
+    parser.add_argument('--output', default=None, help='Output file (defaults to data/schools-with-addresses.json or .parquet)')
+    parser.add_argument('--output-format', choices=['json', 'parquet'], default='json', help='Output format, parquet requires pyarrow')
+    
+    args = parser.parse_args()
+    
+    if args.output is None:
+        args.output = f"data/schools-with-addresses.{args.output_format}"
+    
+    try:
+        count = convert(args.input, args.output, args.output_format)
+    except Exception as e:
+        print(f"Error converting {args.input}: {e}")
+        sys.exit(1)
+    
+    print(f"Saved {count} schools to {args.output}")
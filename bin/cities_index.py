@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+import csv
+import os
+import tempfile
+import threading
+import numpy as np
+import reverse_geocoder as rg
+from scipy.spatial import cKDTree
+
+# The cities dataset shipped with reverse_geocoder
+# (columns: lat, lon, name, admin1, admin2, cc)
+RG_CITIES_FILE = os.path.join(os.path.dirname(rg.__file__), rg.RG_FILE)
+
+# The dataset is stored as one .npy file per column, e.g. data/cities.lat.npy
+# in the repository, so the arrays can be memory-mapped and shared between
+# processes instead of each process parsing the CSV into a list of dicts
+INDEX_PREFIX = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "cities")
+COORDINATE_COLUMNS = ["lat", "lon"]
+TEXT_COLUMNS = ["name", "admin1", "admin2", "cc"]
+
+# Index loaded by load_index(), shared by every lookup in this process
+_index = None
+_index_lock = threading.Lock()
+
+def column_path(column, prefix=INDEX_PREFIX):
+    """Path of the .npy file holding one column of the dataset."""
+    return f"{prefix}.{column}.npy"
+
+def build_index(prefix=INDEX_PREFIX, source=RG_CITIES_FILE):
+    """
+    Converts the cities CSV into one .npy file per column: float32 arrays
+    for the coordinates and UTF-8 byte strings for the text columns.
+    """
+    with open(source, 'rt', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+
+    columns = {}
+    for column in COORDINATE_COLUMNS:
+        columns[column] = np.array([float(row[column]) for row in rows], dtype=np.float32)
+    for column in TEXT_COLUMNS:
+        columns[column] = np.array([row[column].encode('utf-8') for row in rows], dtype=np.bytes_)
+
+    directory = os.path.dirname(prefix)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    for column, values in columns.items():
+        # Write to a temporary file first so a concurrent reader never sees
+        # a partially written array, with a unique name so processes
+        # building the index at the same time don't write to the same file
+        path = column_path(column, prefix)
+        fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(path) or None, suffix=".npy")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, values)
+            # mkstemp() creates the file readable by its owner only
+            os.chmod(temp_file, 0o644)
+            os.replace(temp_file, path)
+        except BaseException:
+            os.unlink(temp_file)
+            raise
+
+def open_index(prefix=INDEX_PREFIX):
+    """
+    Memory-maps the column arrays, building them first if they don't exist,
+    and indexes the coordinates with a K-D tree.
+
+    Returns a (tree, columns) tuple.
+    """
+    paths = [column_path(column, prefix) for column in COORDINATE_COLUMNS + TEXT_COLUMNS]
+    if not all(os.path.exists(path) for path in paths):
+        try:
+            build_index(prefix)
+        except OSError as e:
+            raise OSError(
+                f"Cities index {prefix}.*.npy is missing and couldn't be built ({e}), "
+                "build it with `python bin/cities_index.py`"
+            ) from e
+
+    columns = {
+        column: np.load(column_path(column, prefix), mmap_mode='r')
+        for column in COORDINATE_COLUMNS + TEXT_COLUMNS
+    }
+    tree = cKDTree(np.column_stack([columns["lat"], columns["lon"]]))
+    return tree, columns
+
+def load_index():
+    """Get or open the index shared by this process."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = open_index()
+    return _index
+
+def nearest(coordinates, workers=1):
+    """
+    Returns an array with the position of the nearest city in the index
+    for each (lat, lon) tuple in coordinates.
+
+    workers is the number of threads the K-D tree query runs on, -1 to use
+    every CPU, which is worth it for large batches of coordinates.
+    """
+    tree, _ = load_index()
+
+    points = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+
+    # Schools often share coordinates, so only query each distinct point once
+    # and scatter the results back
+    unique_points, inverse = np.unique(points, axis=0, return_inverse=True)
+    _, indices = tree.query(unique_points, k=1, workers=workers)
+    return indices[inverse.reshape(-1)]
+
+def get_city(index):
+    """
+    Returns the city at a position in the index as a dict with the same keys
+    as reverse_geocoder results: lat, lon, name, admin1, admin2 and cc.
+    """
+    _, columns = load_index()
+
+    # Round the float32 coordinates to the 5 decimal places of the dataset,
+    # e.g. 48.73333 instead of 48.73332977294922
+    city = {column: round(float(columns[column][index]), 5) for column in COORDINATE_COLUMNS}
+    for column in TEXT_COLUMNS:
+        city[column] = columns[column][index].decode('utf-8')
+    return city
+
+def query(coordinates):
+    """
+    Finds the nearest city to each (lat, lon) tuple in coordinates.
+    """
+    return [get_city(index) for index in nearest(coordinates)]
+
+if __name__ == "__main__":
+    print(f"Building cities index from {RG_CITIES_FILE}...")
+    build_index()
+    print(f"Saved cities index to {INDEX_PREFIX}.*.npy")
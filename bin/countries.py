@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+import pycountry
+
+# Country names used by OpenStreetMap that aren't an ISO 3166 name of the
+# country in pycountry
+COUNTRY_ALIASES = {
+    "Russia": "RU",
+    "Republic of Korea": "KR",
+    "Czechia": "CZ",
+    "Czech Republic": "CZ",
+    "Turkey": "TR",
+    "Brunei": "BN",
+    "Cape Verde": "CV",
+    "Ivory Coast": "CI",
+    "Côte d'Ivoire": "CI",
+    "Democratic Republic of the Congo": "CD",
+    "Congo-Brazzaville": "CG",
+    "Republic of the Congo": "CG",
+    "The Gambia": "GM",
+    "The Bahamas": "BS",
+    "East Timor": "TL",
+    "Micronesia": "FM",
+    "Palestine": "PS",
+    "Vatican City": "VA",
+    "Macedonia": "MK",
+    "Swaziland": "SZ",
+    "Burma": "MM",
+    "Kosovo": "XK",
+    "United States of America": "US",
+    "The Netherlands": "NL",
+    "Sao Tome and Principe": "ST",
+    "São Tomé and Príncipe": "ST",
+    "Falkland Islands": "FK",
+    "Saint Helena": "SH",
+}
+
+# ISO 3166 country names, official names and common names (e.g. "South
+# Korea") plus the aliases above, precomputed once since the set of
+# countries is fixed, and looked up case-insensitively
+_NAME_TO_CC = {}
+for _country in pycountry.countries:
+    for _attribute in ("name", "official_name", "common_name"):
+        if hasattr(_country, _attribute):
+            _NAME_TO_CC[getattr(_country, _attribute).casefold()] = _country.alpha_2
+for _name, _country_code in COUNTRY_ALIASES.items():
+    _NAME_TO_CC[_name.casefold()] = _country_code
+
+# Results of fuzzy searches, including the names that matched nothing
+_fuzzy_country_codes = {}
+
+def get_country_code(country_name):
+    """
+    Try to find the ISO country code for a given country name using pycountry.
+    Returns None if not found.
+    """
+    if not country_name:
+        return None
+    
+    # Try direct lookup
+    country_code = _NAME_TO_CC.get(country_name.casefold())
+    if country_code:
+        return country_code
+    
+    # Try fuzzy search if direct lookup fails, which is slow so the result is
+    # cached whether a country was found or not
+    if country_name not in _fuzzy_country_codes:
+        country_code = None
+        try:
+            countries = pycountry.countries.search_fuzzy(country_name)
+            if countries:
+                country_code = countries[0].alpha_2
+        except (AttributeError, LookupError):
+            # Handle cases where the country name isn't recognized
+            pass
+        _fuzzy_country_codes[country_name] = country_code
+    
+    return _fuzzy_country_codes[country_name]
+
+# ISO 3166 country names by country code
+_CC_TO_NAME = {country.alpha_2: country.name for country in pycountry.countries}
+
+def get_country_name(country_code):
+    """
+    Get the full country name from a country code.
+    Returns the country code if the name can't be found.
+    """
+    return _CC_TO_NAME.get(country_code, country_code)
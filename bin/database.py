@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+
+import os
+
+# Directories where PostgreSQL usually puts its Unix socket
+# (Debian/Ubuntu, then macOS/Homebrew)
+SOCKET_DIRECTORIES = ["/var/run/postgresql", "/tmp"]
+
+def get_database_host(port):
+    """
+    Returns the host to connect to: $PGHOST if set, otherwise the directory
+    of the local PostgreSQL Unix socket for port, which avoids going through
+    TCP loopback on every query, and localhost if there is none.
+    """
+    if os.environ.get("PGHOST"):
+        return os.environ["PGHOST"]
+    
+    for directory in SOCKET_DIRECTORIES:
+        if os.path.exists(os.path.join(directory, f".s.PGSQL.{port}")):
+            return directory
+    
+    return "localhost"
@@ -1,68 +1,210 @@
 #!/usr/bin/env python3
 
 import sys
-import json
+import orjson
 import psycopg2
 import os
-import reverse_geocoder as rg
-import pycountry
+import sqlite3
 from psycopg2 import pool
-import functools
 import threading
+import weakref
 
-# Initialize reverse_geocoder once at module level to avoid reloading the dataset on each call
-# Set mode to 2 for faster performance (using kdtree)
-rg_search = rg.RGeocoder(mode=2, verbose=False)
+# Import the nearest city lookup used as a fallback, the database host
+# lookup and the country names from the bin directory
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import cities_index
+from database import get_database_host
+from countries import get_country_code, get_country_name
 
-# Create a thread-local storage for connection pools
-_thread_local = threading.local()
+# Maximum number of pooled connections, which is also the maximum number
+# of threads that can query the database at once
+MAX_CONNECTIONS = 64
+
+# Connections opened when the pool is created, so the first lookups don't
+# all pay for connecting and authenticating
+MIN_CONNECTIONS = 8
+
+# Connection pool shared by all the threads of the process
+_connection_pool = None
+_connection_pool_lock = threading.Lock()
 
 # Create a connection pool
 def get_connection_pool():
-    """Get or create a connection pool for the current thread."""
-    if not hasattr(_thread_local, 'connection_pool'):
-        # Adjust these to match your database credentials:
-        dbname = "reverse_geo"
-        dbuser = os.environ.get("USER", "gabin")  # Use system username instead of postgres
-        dbpass = ""               # fill in if you require a password
-        dbhost = "localhost"      # or your DB host
-        dbport = 5432             # or your DB port
-        
-        # Create a connection pool with 5 connections per process
-        _thread_local.connection_pool = pool.ThreadedConnectionPool(
-            1, 5, 
-            dbname=dbname,
-            user=dbuser,
-            password=dbpass,
-            host=dbhost,
-            port=dbport
+    """Get or create the connection pool shared by all threads."""
+    global _connection_pool
+    if _connection_pool is None:
+        # Worker threads can all ask for the pool at once on startup: only
+        # let the first one create it
+        with _connection_pool_lock:
+            if _connection_pool is None:
+                # Adjust these to match your database credentials:
+                dbname = "reverse_geo"
+                dbuser = os.environ.get("USER", "gabin")  # Use system username instead of postgres
+                dbpass = ""               # fill in if you require a password
+                dbport = 5432             # or your DB port
+                dbhost = get_database_host(dbport)  # or your DB host
+                
+                # ThreadedConnectionPool is thread-safe, so a single pool serves
+                # every worker thread
+                _connection_pool = pool.ThreadedConnectionPool(
+                    MIN_CONNECTIONS, MAX_CONNECTIONS,
+                    dbname=dbname,
+                    user=dbuser,
+                    password=dbpass,
+                    host=dbhost,
+                    port=dbport
+                )
+    return _connection_pool
+
+# Coordinates are rounded to 5 decimal places before lookups for better
+# cache hits (about 1.1 meters precision at the equator)
+COORDINATE_SCALE = 100000
+
+# Connections on which prepare_statements() already ran. psycopg2
+# connections don't take attributes, so they are tracked here instead
+_prepared_connections = weakref.WeakSet()
+
+def prepare_statements(connection):
+    """
+    Prepare the boundaries lookups on a connection, once per session, so
+    that each lookup skips parsing and planning the query.
+    """
+    if connection in _prepared_connections:
+        return
+    
+    cursor = connection.cursor()
+    
+    # NOTE: ST_Point(x, y) => x=lon, y=lat
+    # Only the admin levels used by build_result() are returned: country (2),
+    # state (4) and city (7, 8, 9)
+    
+    # admin_at(lon, lat) returns the boundaries containing a point
+    cursor.execute("""
+        PREPARE admin_at(float8, float8) AS
+        SELECT admin_level, name
+        FROM boundaries
+        WHERE geom && ST_SetSRID(ST_Point($1, $2), 4326)
+        AND admin_level IN (2, 4, 7, 8, 9)
+        AND ST_Contains(
+            geom,
+            ST_SetSRID(ST_Point($1, $2), 4326)
         )
-    return _thread_local.connection_pool
+        ORDER BY admin_level;
+    """)
+    
+    # admin_at_batch(lons, lats) returns the boundaries containing each
+    # point, tagged with the position of the point (from 1)
+    cursor.execute("""
+        PREPARE admin_at_batch(float8[], float8[]) AS
+        SELECT t.idx, b.admin_level, b.name
+        FROM unnest($1, $2) WITH ORDINALITY AS t(lon, lat, idx)
+        JOIN LATERAL (
+            SELECT admin_level, name
+            FROM boundaries
+            WHERE geom && ST_SetSRID(ST_Point(t.lon, t.lat), 4326)
+            AND admin_level IN (2, 4, 7, 8, 9)
+            AND ST_Contains(
+                geom,
+                ST_SetSRID(ST_Point(t.lon, t.lat), 4326)
+            )
+        ) b ON TRUE
+        ORDER BY t.idx, b.admin_level;
+    """)
+    cursor.close()
+    connection.commit()
+    
+    _prepared_connections.add(connection)
 
-# Cache for reverse geocoding results
+# Cache for reverse geocoding results, keyed by get_cache_key(). The result
+# dicts are shared by every caller, so they must not be modified. Reads don't
+# take the lock (a dict lookup is atomic), only inserts do
 _geocode_cache = {}
 _cache_lock = threading.Lock()
 
-def get_country_code(country_name):
+def get_cache_key(lat, lon):
     """
-    Try to find the ISO country code for a given country name using pycountry.
-    Returns None if not found.
+    Returns the cache key of the point (lat, lon): its coordinates rounded to
+    5 decimal places, as integers so that equal points always get equal keys.
     """
-    try:
-        # Try direct lookup
-        country = pycountry.countries.get(name=country_name)
-        if country:
-            return country.alpha_2
-        
-        # Try fuzzy search if direct lookup fails
-        countries = pycountry.countries.search_fuzzy(country_name)
-        if countries:
-            return countries[0].alpha_2
-    except (AttributeError, LookupError):
-        # Handle cases where the country name isn't recognized
-        pass
+    return (round(lat * COORDINATE_SCALE), round(lon * COORDINATE_SCALE))
+
+# Optional on-disk copy of the cache, so that a new run doesn't look up the
+# points of the previous runs again (see enable_persistent_cache())
+_persistent_cache = None
+_persistent_cache_lock = threading.Lock()
+
+# Results cached since the last flush_persistent_cache()
+_unsaved_results = []
+
+def get_persistent_key(cache_key):
+    """
+    Packs a cache key into a single 64-bit integer: the latitude in the high
+    32 bits and the longitude in the low 32 bits.
+    """
+    lat_i, lon_i = cache_key
+    return (lat_i << 32) | (lon_i & 0xffffffff)
+
+def get_cache_key_from_persistent_key(persistent_key):
+    """Unpacks a key made by get_persistent_key()."""
+    lat_i = persistent_key >> 32
+    lon_i = persistent_key & 0xffffffff
+    if lon_i >= 1 << 31:
+        lon_i -= 1 << 32
+    return (lat_i, lon_i)
+
+def enable_persistent_cache(path):
+    """
+    Backs the cache with the SQLite database at path: the results it holds
+    are loaded into the cache, and new results are written to it by
+    flush_persistent_cache().
+    """
+    global _persistent_cache
     
-    return None
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute("CREATE TABLE IF NOT EXISTS geo (k INTEGER PRIMARY KEY, v TEXT)")
+    connection.commit()
+    
+    with _cache_lock:
+        for persistent_key, result_json in connection.execute("SELECT k, v FROM geo"):
+            _geocode_cache[get_cache_key_from_persistent_key(persistent_key)] = orjson.loads(result_json)
+    
+    _persistent_cache = connection
+
+def flush_persistent_cache():
+    """
+    Writes the results cached since the last call to the persistent cache,
+    in a single transaction. Does nothing if it isn't enabled.
+    """
+    global _unsaved_results
+    if _persistent_cache is None:
+        return
+    
+    with _persistent_cache_lock:
+        with _cache_lock:
+            results, _unsaved_results = _unsaved_results, []
+        
+        if results:
+            with _persistent_cache:
+                _persistent_cache.executemany(
+                    "INSERT OR REPLACE INTO geo (k, v) VALUES (?, ?)",
+                    [(get_persistent_key(key), orjson.dumps(result).decode()) for key, result in results]
+                )
+
+def cache_result(cache_key, result, persist=True):
+    """
+    Adds a result to the cache, and to the persistent cache on the next
+    flush if persist is set.
+    """
+    with _cache_lock:
+        _geocode_cache[cache_key] = result
+        if persist and _persistent_cache is not None:
+            _unsaved_results.append((cache_key, result))
 
 def determine_city(city_candidates, rg_result=None):
     """
@@ -89,21 +231,108 @@ def determine_city(city_candidates, rg_result=None):
     
     return None
 
-@functools.lru_cache(maxsize=10000)
-def get_administrative_boundaries_cached(lat, lon):
+def needs_nearest_city(rows):
+    """
+    Whether build_result() falls back to the nearest city for the point
+    with these boundaries rows: when there is no country (admin_level 2) or
+    its name can't be mapped to a country code.
     """
-    Cached version of get_administrative_boundaries without debug parameter.
+    country = None
+    for admin_level, name in rows:
+        if admin_level == 2:
+            country = name
+    return get_country_code(country) is None
+
+def build_result(rows, lat, lon, nearest_city=None):
     """
-    # Round coordinates to 5 decimal places for better cache hits
-    # (about 1.1 meters precision at the equator)
-    lat_rounded = round(lat, 5)
-    lon_rounded = round(lon, 5)
+    Builds the result structure for the point (lat, lon) from the
+    (admin_level, name) rows of the boundaries containing it.
     
+    nearest_city is the cities index entry nearest to the point, if it was
+    already looked up, otherwise it's looked up when needed.
+    
+    Returns a (result, complete) tuple, complete being False if the nearest
+    city was needed but couldn't be found, so the result shouldn't be kept
+    across runs.
+    """
+    # Initialize result structure
+    result = {
+        "countryCode": None,
+        "country": None,
+        "state": None,
+        "city": None
+    }
+    
+    # Track if we have admin_level 2 (country)
+    has_admin_level_2 = False
+    
+    # Store city candidates from different admin levels
+    city_candidates = {
+        7: None,
+        8: None,
+        9: None
+    }
+    
+    # Process database results, the lookups only return admin levels
+    # 2, 4, 7, 8 and 9
+    for admin_level, name in rows:
+        # Assign values to the appropriate fields
+        if admin_level == 2:
+            result["country"] = name
+            # Try to get country code using pycountry
+            result["countryCode"] = get_country_code(name)
+            has_admin_level_2 = True
+        elif admin_level == 4:
+            result["state"] = name
+        elif admin_level in [7, 8, 9]:
+            city_candidates[admin_level] = name
+    
+    # Apply city selection logic: prefer level 8, then 9, then 7
+    result["city"] = determine_city(city_candidates)
+    complete = True
+    
+    # If admin_level 2 is missing or we couldn't map the country to a code,
+    # use the nearest city from the reverse_geocoder dataset for country
+    # information. The index is only loaded on first use, and its arrays are
+    # memory-mapped so processes share a single copy through the page cache
+    if not has_admin_level_2 or result["countryCode"] is None:
+        try:
+            # The index expects coordinates as (lat, lon)
+            rg_result = nearest_city or cities_index.query([(lat, lon)])[0]
+            
+            # Add the country code
+            result["countryCode"] = rg_result['cc']
+            
+            # If we don't have a country name yet, use the one from reverse_geocoder
+            if not result["country"]:
+                # Get full country name from country code, or just use the
+                # country code
+                result["country"] = get_country_name(rg_result['cc'])
+            
+            # If city is still null, try to use the name from reverse_geocoder
+            if result["city"] is None:
+                result["city"] = determine_city(city_candidates, rg_result)
+        except Exception as e:
+            # If reverse_geocoder fails, just continue with what we have
+            complete = False
+    
+    return result, complete
+
+def _get_administrative_boundaries_dict(lat, lon):
+    """
+    Cached version of get_administrative_boundaries without debug parameter,
+    returning the result dict instead of JSON.
+    """
     # Check if we have this in our cache
-    cache_key = (lat_rounded, lon_rounded)
-    with _cache_lock:
-        if cache_key in _geocode_cache:
-            return _geocode_cache[cache_key]
+    cache_key = get_cache_key(lat, lon)
+    cached = _geocode_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    # Look up the rounded point, so the cached result is the same whichever
+    # point of the key is looked up first
+    lat_rounded = cache_key[0] / COORDINATE_SCALE
+    lon_rounded = cache_key[1] / COORDINATE_SCALE
     
     # Initialize result structure
     result = {
@@ -112,6 +341,7 @@ def get_administrative_boundaries_cached(lat, lon):
         "state": None,
         "city": None
     }
+    succeeded = False
     
     try:
         # Get a connection from the pool
@@ -119,91 +349,16 @@ def get_administrative_boundaries_cached(lat, lon):
         connection = connection_pool.getconn()
         
         try:
+            prepare_statements(connection)
             cursor = connection.cursor()
 
-            # NOTE: ST_Point(x, y) => x=lon, y=lat
-            query = """
-                SELECT admin_level, name
-                FROM boundaries
-                WHERE ST_Contains(
-                    geom,
-                    ST_SetSRID(ST_Point(%s, %s), 4326)
-                )
-                ORDER BY admin_level::int;
-            """
-
             # We pass (lon, lat) since ST_Point expects (x=lon, y=lat).
-            cursor.execute(query, (lon_rounded, lat_rounded))
+            cursor.execute("EXECUTE admin_at(%s, %s);", (lon_rounded, lat_rounded))
             rows = cursor.fetchall()
 
             cursor.close()
             
-            # Track if we have admin_level 2 (country)
-            has_admin_level_2 = False
-            
-            # Store city candidates from different admin levels
-            city_candidates = {
-                7: None,
-                8: None,
-                9: None
-            }
-            
-            # Process database results
-            for admin_level, name in rows:
-                # Convert admin_level to int if it's a string
-                try:
-                    if admin_level is None:
-                        # Skip entries with None admin_level
-                        continue
-                        
-                    admin_level_int = int(admin_level) if isinstance(admin_level, str) else admin_level
-                    
-                    # Assign values to the appropriate fields
-                    if admin_level_int == 2:
-                        result["country"] = name
-                        # Try to get country code using pycountry
-                        result["countryCode"] = get_country_code(name)
-                        has_admin_level_2 = True
-                    elif admin_level_int == 4:
-                        result["state"] = name
-                    elif admin_level_int in [7, 8, 9]:
-                        city_candidates[admin_level_int] = name
-                except (ValueError, TypeError):
-                    continue
-            
-            # Apply city selection logic: prefer level 8, then 9, then 7
-            result["city"] = determine_city(city_candidates)
-            
-            # If admin_level 2 is missing or we couldn't map the country to a code,
-            # use reverse_geocoder for country information
-            if not has_admin_level_2 or result["countryCode"] is None:
-                try:
-                    # reverse_geocoder expects coordinates as (lat, lon)
-                    rg_result = rg_search.query([(lat_rounded, lon_rounded)])[0]
-                    
-                    # Add the country code
-                    result["countryCode"] = rg_result['cc']
-                    
-                    # If we don't have a country name yet, use the one from reverse_geocoder
-                    if not result["country"]:
-                        # Try to get full country name from country code
-                        try:
-                            country = pycountry.countries.get(alpha_2=rg_result['cc'])
-                            if country:
-                                result["country"] = country.name
-                            else:
-                                # Fallback to just using the country code
-                                result["country"] = rg_result['cc']
-                        except (AttributeError, LookupError):
-                            # Fallback to just using the country code
-                            result["country"] = rg_result['cc']
-                    
-                    # If city is still null, try to use the name from reverse_geocoder
-                    if result["city"] is None:
-                        result["city"] = determine_city(city_candidates, rg_result)
-                except Exception as e:
-                    # If reverse_geocoder fails, just continue with what we have
-                    pass
+            result, succeeded = build_result(rows, lat_rounded, lon_rounded)
         
         finally:
             # Return the connection to the pool
@@ -214,11 +369,90 @@ def get_administrative_boundaries_cached(lat, lon):
         # we'll just return the empty result structure
         pass
     
-    # Cache the result
-    with _cache_lock:
-        _geocode_cache[cache_key] = json.dumps(result)
+    # Cache the result, but only keep it across runs if the lookup and the
+    # nearest city fallback succeeded
+    cache_result(cache_key, result, persist=succeeded)
+    
+    return result
+
+def get_administrative_boundaries_batch(coordinates):
+    """
+    Batch version of _get_administrative_boundaries_dict.
+    
+    Looks up every (lat, lon) in coordinates that isn't cached yet with a
+    single database query, and returns the result dicts in the same order
+    as coordinates.
+    """
+    cache_keys = [get_cache_key(lat, lon) for lat, lon in coordinates]
+    missing = [key for key in dict.fromkeys(cache_keys) if key not in _geocode_cache]
+    
+    if missing:
+        # Boundaries rows for each missing point, by position in missing
+        rows_by_point = [[] for _ in missing]
+        results = None
+        complete = [False] * len(missing)
+        
+        try:
+            # Get a connection from the pool
+            connection_pool = get_connection_pool()
+            connection = connection_pool.getconn()
+            
+            try:
+                prepare_statements(connection)
+                cursor = connection.cursor()
+                
+                # Look up the rounded points, like the single point lookup
+                lats = [lat / COORDINATE_SCALE for lat, lon in missing]
+                lons = [lon / COORDINATE_SCALE for lat, lon in missing]
+                cursor.execute("EXECUTE admin_at_batch(%s, %s);", (lons, lats))
+                
+                # Group the rows by point, WITH ORDINALITY counts from 1
+                for idx, admin_level, name in cursor.fetchall():
+                    rows_by_point[idx - 1].append((admin_level, name))
+                
+                cursor.close()
+                
+                # Find the nearest city of every point that needs one with a
+                # single K-D tree query, instead of one query per point
+                fallback_points = [i for i, rows in enumerate(rows_by_point) if needs_nearest_city(rows)]
+                nearest_cities = [None] * len(missing)
+                if fallback_points:
+                    try:
+                        cities = cities_index.query([(lats[i], lons[i]) for i in fallback_points])
+                        for i, city in zip(fallback_points, cities):
+                            nearest_cities[i] = city
+                    except Exception as e:
+                        # Leave the nearest cities unset, build_result() then
+                        # looks them up point by point, so a failed fallback
+                        # doesn't lose the boundaries found in the database
+                        nearest_cities = [None] * len(missing)
+                
+                results, complete = zip(*[
+                    build_result(rows, lat, lon, nearest_city)
+                    for rows, lat, lon, nearest_city in zip(rows_by_point, lats, lons, nearest_cities)
+                ])
+            
+            finally:
+                # Return the connection to the pool
+                connection_pool.putconn(connection)
+        
+        except Exception as e:
+            # If there's any error in the database query or processing,
+            # we'll just return the empty result structure
+            pass
+        
+        if results is None:
+            results = [
+                {"countryCode": None, "country": None, "state": None, "city": None}
+                for _ in missing
+            ]
+        
+        # Cache the results, but only keep them across runs if the lookup and
+        # the nearest city fallback succeeded
+        for key, result, persist in zip(missing, results, complete):
+            cache_result(key, result, persist=persist)
     
-    return json.dumps(result)
+    return [_geocode_cache[key] for key in cache_keys]
 
 def get_administrative_boundaries(lat, lon, debug=False):
     """
@@ -229,11 +463,9 @@ def get_administrative_boundaries(lat, lon, debug=False):
         print(f"DEBUG: Database query for coordinates ({lat}, {lon})")
     
     # Call the cached version
-    result_json = get_administrative_boundaries_cached(lat, lon)
+    result = _get_administrative_boundaries_dict(lat, lon)
     
     if debug:
-        # Parse the result for debug output
-        result = json.loads(result_json)
         print("DEBUG: Final result:")
         print(f"DEBUG:   countryCode={result['countryCode']}")
         print(f"DEBUG:   country={result['country']}")
@@ -242,8 +474,8 @@ def get_administrative_boundaries(lat, lon, debug=False):
     
     # Return the structured JSON with indentation if debug is enabled
     if debug:
-        return json.dumps(json.loads(result_json), indent=2)
-    return result_json
+        return orjson.dumps(result, option=orjson.OPT_INDENT_2).decode()
+    return orjson.dumps(result).decode()
 
 if __name__ == "__main__":
     import argparse
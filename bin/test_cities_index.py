@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import tempfile
+import threading
+from unittest.mock import patch
+
+# Add the parent directory to the path so we can import the module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Import the module to test
+from bin import cities_index
+
+class TestCitiesIndex(unittest.TestCase):
+    
+    def setUp(self):
+        """Build an index from a small cities file in a temporary directory"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        source = os.path.join(self.temp_dir.name, 'cities.csv')
+        with open(source, 'w', encoding='utf-8') as f:
+            f.write("lat,lon,name,admin1,admin2,cc\n")
+            f.write("48.73661,1.36574,Dreux,Centre,Eure-et-Loir,FR\n")
+            f.write("-33.92584,18.42322,Cape Town,Western Cape,City of Cape Town,ZA\n")
+            f.write("41.89193,12.51133,Roma,Lazio,Città metropolitana di Roma Capitale,IT\n")
+        
+        self.prefix = os.path.join(self.temp_dir.name, 'index', 'cities')
+        cities_index.build_index(self.prefix, source)
+    
+    def tearDown(self):
+        self.temp_dir.cleanup()
+    
+    def test_build_index_writes_one_file_per_column(self):
+        """Test that every column is saved to its own .npy file"""
+        for column in cities_index.COORDINATE_COLUMNS + cities_index.TEXT_COLUMNS:
+            self.assertTrue(os.path.exists(cities_index.column_path(column, self.prefix)))
+    
+    def test_concurrent_builds(self):
+        """Test that processes building the index at once don't share temporary files"""
+        source = os.path.join(self.temp_dir.name, 'cities.csv')
+        prefix = os.path.join(self.temp_dir.name, 'concurrent', 'cities')
+        errors = []
+        
+        def build():
+            try:
+                cities_index.build_index(prefix, source)
+            except Exception as e:
+                errors.append(e)
+        
+        threads = [threading.Thread(target=build) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        # Every column is complete and no temporary file is left behind
+        self.assertEqual(errors, [])
+        self.assertEqual(
+            sorted(os.listdir(os.path.dirname(prefix))),
+            sorted(os.path.basename(cities_index.column_path(column, prefix))
+                   for column in cities_index.COORDINATE_COLUMNS + cities_index.TEXT_COLUMNS)
+        )
+        with patch.object(cities_index, '_index', cities_index.open_index(prefix)):
+            self.assertEqual(cities_index.query([(41.9, 12.5)])[0]['name'], 'Roma')
+    
+    def test_query_returns_nearest_cities(self):
+        """Test that each coordinate is matched to its nearest city, in order"""
+        with patch.object(cities_index, '_index', cities_index.open_index(self.prefix)):
+            results = cities_index.query([(-33.9331562, 18.5182556), (48.7331439, 1.3615715), (41.9, 12.5)])
+        
+        self.assertEqual([r['name'] for r in results], ['Cape Town', 'Dreux', 'Roma'])
+        self.assertEqual(results[0]['cc'], 'ZA')
+        self.assertEqual(results[1]['admin1'], 'Centre')
+        self.assertEqual(results[2]['admin2'], 'Città metropolitana di Roma Capitale')
+        self.assertEqual(results[1]['lat'], 48.73661)
+        self.assertEqual(results[0]['lon'], 18.42322)
+    
+    def test_nearest_with_repeated_coordinates(self):
+        """Test that repeated coordinates each get a result, in order"""
+        coordinates = [(41.9, 12.5), (48.7331439, 1.3615715), (41.9, 12.5), (41.9, 12.5)]
+        with patch.object(cities_index, '_index', cities_index.open_index(self.prefix)):
+            indices = cities_index.nearest(coordinates)
+        
+        self.assertEqual(indices.tolist(), [2, 0, 2, 2])
+    
+    def test_index_prefix_is_in_repository(self):
+        """Test that the default index lives in the repository's data directory"""
+        repository = os.path.dirname(os.path.dirname(os.path.abspath(cities_index.__file__)))
+        self.assertEqual(cities_index.INDEX_PREFIX, os.path.join(repository, 'data', 'cities'))
+    
+    def test_open_index_reports_failed_build(self):
+        """Test that a missing index that can't be built raises a clear error"""
+        prefix = os.path.join(self.temp_dir.name, 'missing', 'cities')
+        with patch.object(cities_index, 'build_index', side_effect=PermissionError("Permission denied")):
+            with self.assertRaises(OSError) as context:
+                cities_index.open_index(prefix)
+        
+        self.assertIn("python bin/cities_index.py", str(context.exception))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+from unittest.mock import patch
+
+# Add the parent directory to the path so we can import the module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Import the module to test
+from bin import countries
+from bin.countries import get_country_code, get_country_name
+
+class TestCountries(unittest.TestCase):
+    
+    def test_country_code(self):
+        """Test country code lookups by ISO name, common name, alias and case"""
+        self.assertEqual(get_country_code("South Africa"), "ZA")
+        self.assertEqual(get_country_code("Korea, Republic of"), "KR")
+        self.assertEqual(get_country_code("South Korea"), "KR")
+        self.assertEqual(get_country_code("Russia"), "RU")
+        self.assertEqual(get_country_code("Kosovo"), "XK")
+        self.assertEqual(get_country_code("Ivory Coast"), "CI")
+        self.assertEqual(get_country_code("france"), "FR")
+        self.assertIsNone(get_country_code("Not a country"))
+        self.assertIsNone(get_country_code(None))
+    
+    def test_country_code_caches_fuzzy_misses(self):
+        """Test that a name matching no country is only fuzzy searched once"""
+        with patch.object(countries, '_fuzzy_country_codes', {}), \
+                patch.object(countries.pycountry.countries, 'search_fuzzy', side_effect=LookupError) as mock_search:
+            self.assertIsNone(get_country_code("Atlantis"))
+            self.assertIsNone(get_country_code("Atlantis"))
+        
+        mock_search.assert_called_once_with("Atlantis")
+    
+    def test_country_name(self):
+        """Test country name lookups, falling back to the country code"""
+        self.assertEqual(get_country_name("FR"), "France")
+        self.assertEqual(get_country_name("ZZ"), "ZZ")
+
+if __name__ == '__main__':
+    unittest.main()
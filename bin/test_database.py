@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import tempfile
+from unittest.mock import patch
+
+# Add the parent directory to the path so we can import the module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Import the module to test
+from bin.database import get_database_host
+
+class TestDatabase(unittest.TestCase):
+    
+    def test_database_host_prefers_local_socket(self):
+        """Test that PGHOST wins, then a local Unix socket, then localhost"""
+        with tempfile.TemporaryDirectory() as socket_dir:
+            with patch('bin.database.SOCKET_DIRECTORIES', [socket_dir]), \
+                    patch.dict(os.environ, {'PGHOST': ''}):
+                self.assertEqual(get_database_host(5432), 'localhost')
+                
+                open(os.path.join(socket_dir, '.s.PGSQL.5432'), 'w').close()
+                self.assertEqual(get_database_host(5432), socket_dir)
+                self.assertEqual(get_database_host(5433), 'localhost')
+                
+                with patch.dict(os.environ, {'PGHOST': 'db.example.com'}):
+                    self.assertEqual(get_database_host(5432), 'db.example.com')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+import unittest
+import json
+import sys
+import os
+import tempfile
+import io
+import contextlib
+import importlib.util
+from unittest.mock import patch
+
+# Add the parent directory to the path so we can import the module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Import the module to test, its name isn't a valid module name
+_spec = importlib.util.spec_from_file_location(
+    "process_schools",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "4-process-schools.py")
+)
+process_schools_module = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(process_schools_module)
+
+def record(osm_id, city):
+    """An NDJSON output line, as written by process_schools"""
+    return json.dumps({"osm_id": osm_id, "data": {"name": osm_id, "address": {"city": city}}}, separators=(',', ':')) + "\n"
+
+def mock_batch(coordinates):
+    """Mock batch lookup returning the same address for every point"""
+    return [{"countryCode": "FR", "country": "France", "state": None, "city": "Dreux"} for _ in coordinates]
+
+class TestProcessSchools(unittest.TestCase):
+    
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.output_file = os.path.join(self.temp_dir.name, 'schools-with-addresses.ndjson')
+    
+    def tearDown(self):
+        self.temp_dir.cleanup()
+    
+    def write(self, path, content):
+        with open(path, 'w') as f:
+            f.write(content)
+    
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+    
+    def test_load_processed_ids_truncates_cut_record(self):
+        """Test that a last record cut short by an interrupted run is removed"""
+        complete = record("N1", "Dreux") + record("N2", "Paris")
+        self.write(self.output_file, complete + '{"osm_id":"N3","data":{"na')
+        
+        processed_ids = process_schools_module.load_processed_ids(self.output_file)
+        
+        self.assertEqual(processed_ids, {"N1", "N2"})
+        self.assertEqual(self.read(self.output_file), complete)
+    
+    def test_load_processed_ids_truncates_record_cut_before_id(self):
+        """Test that a last record cut before its OSM ID was written is removed"""
+        complete = record("N1", "Dreux") + record("N2", "Paris")
+        for tail in ('{', '{"osm', '{"osm_id"', '{"osm_id":'):
+            self.write(self.output_file, complete + tail)
+            
+            processed_ids = process_schools_module.load_processed_ids(self.output_file)
+            
+            self.assertEqual(processed_ids, {"N1", "N2"})
+            self.assertEqual(self.read(self.output_file), complete)
+    
+    def test_load_processed_ids_keeps_record_without_newline(self):
+        """Test that a complete last record missing its newline is kept"""
+        content = record("N1", "Dreux") + record("N2", "Paris")
+        self.write(self.output_file, content[:-1])
+        
+        processed_ids = process_schools_module.load_processed_ids(self.output_file)
+        
+        self.assertEqual(processed_ids, {"N1", "N2"})
+        self.assertEqual(self.read(self.output_file), content)
+    
+    def test_load_processed_ids_refuses_legacy_json(self):
+        """Test that the JSON output of older versions is rejected and left untouched"""
+        legacy = json.dumps({"N1": {"name": "N1", "address": {"city": "Dreux"}}}, indent=2)
+        for content in (legacy, json.dumps(json.loads(legacy))):
+            self.write(self.output_file, content)
+            
+            with self.assertRaises(ValueError):
+                process_schools_module.load_processed_ids(self.output_file)
+            self.assertEqual(self.read(self.output_file), content)
+    
+    def test_process_school_batch_debug_output(self):
+        """Test that debug mode prints the address found for each school"""
+        schools = [{"name": "Lycée Rotrou", "latitude": 48.7331439, "longitude": 1.3615715, "osm": {"type": "way", "id": 1}}]
+        
+        output = io.StringIO()
+        with patch.object(process_schools_module, 'get_administrative_boundaries_batch', side_effect=mock_batch), \
+                contextlib.redirect_stdout(output):
+            results = process_schools_module.process_school_batch(schools, debug=True)
+        
+        self.assertEqual(results[0][0], "W1")
+        self.assertIn("Lycée Rotrou", output.getvalue())
+        self.assertIn("DEBUG:   city=Dreux", output.getvalue())
+    
+    def test_process_schools_resumes(self):
+        """Test that a second run only processes and appends the missing schools"""
+        input_file = os.path.join(self.temp_dir.name, 'schools.json')
+        schools = [
+            {"name": f"School {i}", "latitude": 48.7 + i / 1000, "longitude": 1.3, "osm": {"type": "node", "id": i}}
+            for i in range(5)
+        ]
+        self.write(input_file, json.dumps(schools))
+        
+        # Output of an interrupted run: two schools and a cut record
+        self.write(self.output_file, record("N0", "Dreux") + record("N1", "Dreux") + '{"osm_id":"N2"')
+        
+        with patch.object(process_schools_module, 'get_administrative_boundaries_batch', side_effect=mock_batch) as mock_lookup, \
+                patch.object(process_schools_module, 'get_connection_pool'):
+            process_schools_module.process_schools(input_file, self.output_file, num_workers=1)
+        
+        # Only the three missing schools were looked up
+        self.assertEqual(sum(len(call.args[0]) for call in mock_lookup.call_args_list), 3)
+        
+        lines = [json.loads(line) for line in self.read(self.output_file).splitlines()]
+        self.assertEqual([line["osm_id"] for line in lines], ["N0", "N1", "N2", "N3", "N4"])
+        self.assertEqual(lines[4]["data"]["address"]["city"], "Dreux")
+    
+    def test_process_schools_imports_legacy_output(self):
+        """Test that the JSON output of older versions seeds the NDJSON output"""
+        input_file = os.path.join(self.temp_dir.name, 'schools.json')
+        legacy_file = os.path.join(self.temp_dir.name, 'schools-with-addresses.json')
+        schools = [
+            {"name": f"School {i}", "latitude": 48.7, "longitude": 1.3, "osm": {"type": "node", "id": i}}
+            for i in range(3)
+        ]
+        legacy = json.dumps({"N0": {"name": "School 0", "address": {"city": "Dreux"}}}, indent=2)
+        self.write(input_file, json.dumps(schools))
+        self.write(legacy_file, legacy)
+        
+        with patch.object(process_schools_module, 'get_administrative_boundaries_batch', side_effect=mock_batch) as mock_lookup, \
+                patch.object(process_schools_module, 'get_connection_pool'):
+            process_schools_module.process_schools(input_file, self.output_file, num_workers=1, legacy_file=legacy_file)
+        
+        self.assertEqual(sum(len(call.args[0]) for call in mock_lookup.call_args_list), 2)
+        self.assertEqual(self.read(legacy_file), legacy)
+        
+        lines = [json.loads(line) for line in self.read(self.output_file).splitlines()]
+        self.assertEqual(sorted(line["osm_id"] for line in lines), ["N0", "N1", "N2"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,13 +4,15 @@ import unittest
 import json
 import sys
 import os
+import tempfile
 from unittest.mock import patch, MagicMock
 
 # Add the parent directory to the path so we can import the module
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # Import the module to test
-from bin.reverse_geocoding import determine_city, get_administrative_boundaries
+from bin import reverse_geocoding
+from bin.reverse_geocoding import determine_city, get_administrative_boundaries, get_administrative_boundaries_batch
 
 class TestReverseGeocoding(unittest.TestCase):
     
@@ -56,9 +58,9 @@ class TestReverseGeocoding(unittest.TestCase):
         # Mock the database query results for Cape Town
         # These are example admin levels that might be returned for Cape Town
         mock_cursor.fetchall.return_value = [
-            ('2', 'South Africa'),  # Country
-            ('4', 'Western Cape'),  # Province/State
-            ('8', 'Cape Town')      # City
+            (2, 'South Africa'),  # Country
+            (4, 'Western Cape'),  # Province/State
+            (8, 'Cape Town')      # City
         ]
         
         # Test the coordinates
@@ -76,5 +78,155 @@ class TestReverseGeocoding(unittest.TestCase):
         city_candidates = {7: None, 8: 'Cape Town', 9: None}
         self.assertEqual(determine_city(city_candidates), 'Cape Town')
 
+    @patch('bin.reverse_geocoding.get_connection_pool')
+    def test_batch_coordinates(self, mock_get_connection_pool):
+        """Test that a batch lookup returns one result per coordinate, in order"""
+        # Mock the database connection and cursor
+        mock_conn = MagicMock()
+        mock_cursor = MagicMock()
+        mock_conn.cursor.return_value = mock_cursor
+        
+        # Mock the connection pool
+        mock_pool = MagicMock()
+        mock_pool.getconn.return_value = mock_conn
+        mock_get_connection_pool.return_value = mock_pool
+        
+        # Mock the batched query results, grouped by point index (from 1)
+        mock_cursor.fetchall.return_value = [
+            (1, 2, 'France'),
+            (1, 4, 'Centre-Val de Loire'),
+            (1, 8, 'Dreux'),
+            (2, 2, 'South Africa'),
+            (2, 4, 'Western Cape'),
+            (2, 8, 'Cape Town')
+        ]
+        
+        # Test the coordinates, the repeated point must only be queried once
+        coordinates = [
+            (48.7331439, 1.3615715),
+            (-33.9250000, 18.4240000),
+            (48.7331439, 1.3615715)
+        ]
+        results = get_administrative_boundaries_batch(coordinates)
+        
+        # Verify the results
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0]['countryCode'], 'FR')
+        self.assertEqual(results[0]['city'], 'Dreux')
+        self.assertEqual(results[1]['countryCode'], 'ZA')
+        self.assertEqual(results[1]['state'], 'Western Cape')
+        self.assertEqual(results[1]['city'], 'Cape Town')
+        self.assertEqual(results[2], results[0])
+        lookups = [call for call in mock_cursor.execute.call_args_list if call.args[0].startswith("EXECUTE")]
+        self.assertEqual(len(lookups), 1)
+
+    @patch('bin.reverse_geocoding.get_connection_pool')
+    def test_batch_nearest_city_fallback(self, mock_get_connection_pool):
+        """Test that points without a country get their nearest city in a single query"""
+        # Mock the database connection and cursor
+        mock_conn = MagicMock()
+        mock_cursor = MagicMock()
+        mock_conn.cursor.return_value = mock_cursor
+        
+        # Mock the connection pool
+        mock_pool = MagicMock()
+        mock_pool.getconn.return_value = mock_conn
+        mock_get_connection_pool.return_value = mock_pool
+        
+        # Only the second point is inside a known country
+        mock_cursor.fetchall.return_value = [
+            (2, 2, 'South Africa'),
+            (2, 8, 'Cape Town')
+        ]
+        
+        nearest_cities = [
+            {'name': 'Dreux', 'admin1': 'Centre', 'admin2': '', 'cc': 'FR'},
+            {'name': 'Lisbon', 'admin1': 'Lisbon', 'admin2': '', 'cc': 'PT'}
+        ]
+        coordinates = [
+            (48.7000001, 1.3000001),
+            (-33.9000001, 18.4000001),
+            (38.7000001, -9.1000001)
+        ]
+        with patch.object(reverse_geocoding.cities_index, 'query', return_value=nearest_cities) as mock_query:
+            results = get_administrative_boundaries_batch(coordinates)
+        
+        # Verify the results
+        mock_query.assert_called_once()
+        self.assertEqual(len(mock_query.call_args.args[0]), 2)
+        self.assertEqual(results[0]['countryCode'], 'FR')
+        self.assertEqual(results[0]['city'], 'Dreux')
+        self.assertEqual(results[1]['countryCode'], 'ZA')
+        self.assertEqual(results[1]['city'], 'Cape Town')
+        self.assertEqual(results[2]['countryCode'], 'PT')
+        self.assertEqual(results[2]['country'], 'Portugal')
+
+    @patch('bin.reverse_geocoding.get_connection_pool')
+    def test_batch_nearest_city_fallback_failure(self, mock_get_connection_pool):
+        """Test that a failed nearest city lookup keeps the boundaries found in the database"""
+        # Mock the database connection and cursor
+        mock_conn = MagicMock()
+        mock_cursor = MagicMock()
+        mock_conn.cursor.return_value = mock_cursor
+        
+        # Mock the connection pool
+        mock_pool = MagicMock()
+        mock_pool.getconn.return_value = mock_conn
+        mock_get_connection_pool.return_value = mock_pool
+        
+        # Only the first point is inside a known country
+        mock_cursor.fetchall.return_value = [
+            (1, 2, 'France'),
+            (1, 8, 'Dreux')
+        ]
+        
+        coordinates = [
+            (48.7100001, 1.3100001),
+            (38.7100001, -9.1100001)
+        ]
+        with patch.object(reverse_geocoding.cities_index, 'query', side_effect=RuntimeError("no index")), \
+                patch.object(reverse_geocoding, '_persistent_cache', MagicMock()), \
+                patch.object(reverse_geocoding, '_unsaved_results', []):
+            results = get_administrative_boundaries_batch(coordinates)
+            
+            # Only the complete result is kept across runs
+            unsaved_keys = [key for key, result in reverse_geocoding._unsaved_results]
+            self.assertEqual(unsaved_keys, [reverse_geocoding.get_cache_key(*coordinates[0])])
+        
+        # Verify the results
+        self.assertEqual(results[0]['countryCode'], 'FR')
+        self.assertEqual(results[0]['city'], 'Dreux')
+        self.assertIsNone(results[1]['countryCode'])
+        self.assertIsNone(results[1]['city'])
+
+    def test_persistent_cache(self):
+        """Test that cached results are saved to SQLite and reloaded by the next run"""
+        cache_key = reverse_geocoding.get_cache_key(-33.9331562, -18.5182556)
+        self.assertEqual(
+            reverse_geocoding.get_cache_key_from_persistent_key(reverse_geocoding.get_persistent_key(cache_key)),
+            cache_key
+        )
+        
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache_file = os.path.join(cache_dir, 'geocache.sqlite')
+            
+            # First run: one successful lookup and one failed lookup
+            with patch.object(reverse_geocoding, '_geocode_cache', {}), \
+                    patch.object(reverse_geocoding, '_unsaved_results', []), \
+                    patch.object(reverse_geocoding, '_persistent_cache', None):
+                reverse_geocoding.enable_persistent_cache(cache_file)
+                reverse_geocoding.cache_result(cache_key, {"country": "South Africa"})
+                reverse_geocoding.cache_result((1, 2), {"country": None}, persist=False)
+                reverse_geocoding.flush_persistent_cache()
+                reverse_geocoding._persistent_cache.close()
+            
+            # Second run: only the successful lookup is loaded back
+            with patch.object(reverse_geocoding, '_geocode_cache', {}), \
+                    patch.object(reverse_geocoding, '_unsaved_results', []), \
+                    patch.object(reverse_geocoding, '_persistent_cache', None):
+                reverse_geocoding.enable_persistent_cache(cache_file)
+                self.assertEqual(reverse_geocoding._geocode_cache, {cache_key: {"country": "South Africa"}})
+                reverse_geocoding._persistent_cache.close()
+
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file
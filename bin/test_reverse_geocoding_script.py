@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+import unittest
+import json
+import sys
+import os
+import time
+import threading
+import importlib.util
+from collections import OrderedDict
+from unittest.mock import patch, MagicMock
+
+# Add the parent directory to the path so we can import the module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Import the module to test, its name isn't a valid module name
+_spec = importlib.util.spec_from_file_location(
+    "reverse_geocoding_script",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "3-reverse-geocoding.py")
+)
+reverse_geocoding_script = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(reverse_geocoding_script)
+
+def boundaries_for(lat, lon):
+    """reverse_geo() result naming the city after the point it was looked up for"""
+    return {
+        "country": "France",
+        "state": "Centre-Val de Loire",
+        "city": f"{lat},{lon}",
+        "admin_levels": [{"admin_level": 2, "name": "France"}]
+    }
+
+def mock_query_batch(coordinates):
+    """Mock batch query returning one result per point, in order"""
+    return [boundaries_for(lat, lon) for lat, lon in coordinates]
+
+class TestReverseGeocodingScript(unittest.TestCase):
+    
+    def setUp(self):
+        # Start every test with an empty cache
+        cache_patcher = patch.object(reverse_geocoding_script, '_boundaries_cache', OrderedDict())
+        cache_patcher.start()
+        self.addCleanup(cache_patcher.stop)
+    
+    def test_batch_keeps_order_and_dedups(self):
+        """Test that results follow the input order and repeated points are queried once"""
+        coordinates = [(48.7352, 1.3667), (48.8566, 2.3522), (48.73521, 1.36672)]
+        
+        with patch.object(reverse_geocoding_script, 'query_batch', side_effect=mock_query_batch) as mock_query:
+            results = [json.loads(result) for result in reverse_geocoding_script.batch_reverse_geocode(coordinates)]
+        
+        # The first and last points round to the same cache key
+        mock_query.assert_called_once_with([(48.7352, 1.3667), (48.8566, 2.3522)])
+        self.assertEqual([result["city"] for result in results], ["48.7352,1.3667", "48.8566,2.3522", "48.7352,1.3667"])
+        self.assertEqual(results[0]["countryCode"], "FR")
+    
+    def test_batch_splits_into_chunks(self):
+        """Test that misses are sent to the database BATCH_SIZE points at a time"""
+        coordinates = [(48.0 + i / 100, 1.0) for i in range(5)]
+        
+        with patch.object(reverse_geocoding_script, 'BATCH_SIZE', 2), \
+                patch.object(reverse_geocoding_script, 'query_batch', side_effect=mock_query_batch) as mock_query:
+            results = reverse_geocoding_script.batch_reverse_geocode(coordinates)
+        
+        self.assertEqual([len(call.args[0]) for call in mock_query.call_args_list], [2, 2, 1])
+        self.assertEqual([json.loads(result)["city"] for result in results], [f"{lat},{lon}" for lat, lon in coordinates])
+    
+    def test_batch_uses_cache(self):
+        """Test that cached points, from single or batch lookups, skip the database"""
+        reverse_geocoding_script.cache_boundaries((48.7352, 1.3667), boundaries_for(48.7352, 1.3667))
+        
+        with patch.object(reverse_geocoding_script, 'query_batch', side_effect=mock_query_batch) as mock_query:
+            reverse_geocoding_script.batch_reverse_geocode([(48.7352, 1.3667), (48.8566, 2.3522)])
+            mock_query.assert_called_once_with([(48.8566, 2.3522)])
+            
+            # Both points are cached now
+            mock_query.reset_mock()
+            results = reverse_geocoding_script.batch_reverse_geocode([(48.8566, 2.3522), (48.7352, 1.3667)])
+            mock_query.assert_not_called()
+        
+        self.assertEqual([json.loads(result)["city"] for result in results], ["48.8566,2.3522", "48.7352,1.3667"])
+    
+    def test_cache_evicts_least_recently_used(self):
+        """Test that the cache keeps at most CACHE_SIZE entries, dropping the least recently used"""
+        with patch.object(reverse_geocoding_script, 'CACHE_SIZE', 2):
+            reverse_geocoding_script.cache_boundaries((1.0, 1.0), boundaries_for(1.0, 1.0))
+            reverse_geocoding_script.cache_boundaries((2.0, 2.0), boundaries_for(2.0, 2.0))
+            
+            # Reading the first entry makes the second one the least recently used
+            self.assertIsNotNone(reverse_geocoding_script.get_cached_boundaries((1.0, 1.0)))
+            reverse_geocoding_script.cache_boundaries((3.0, 3.0), boundaries_for(3.0, 3.0))
+            
+            self.assertIsNone(reverse_geocoding_script.get_cached_boundaries((2.0, 2.0)))
+            self.assertIsNotNone(reverse_geocoding_script.get_cached_boundaries((1.0, 1.0)))
+            self.assertIsNotNone(reverse_geocoding_script.get_cached_boundaries((3.0, 3.0)))
+    
+    def test_connection_pool_created_once(self):
+        """Test that threads asking for the pool at once share a single pool"""
+        def slow_pool(*args, **kwargs):
+            # Widen the window between the check and the assignment
+            time.sleep(0.05)
+            return MagicMock()
+        
+        with patch.object(reverse_geocoding_script, '_POOL', None), \
+                patch.object(reverse_geocoding_script.pool, 'ThreadedConnectionPool', side_effect=slow_pool) as mock_pool, \
+                patch.object(reverse_geocoding_script.atexit, 'register'):
+            pools = []
+            threads = [
+                threading.Thread(target=lambda: pools.append(reverse_geocoding_script.get_connection_pool()))
+                for _ in range(8)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        
+        mock_pool.assert_called_once()
+        self.assertEqual(len(set(map(id, pools))), 1)
+
+if __name__ == '__main__':
+    unittest.main()